@@ -1,9 +1,14 @@
+import contextlib
+import io
 import sys
-from dr_mario_logic import DrMario, parse_line_content
+import time
+from typing import Dict, List, Optional
+from dr_mario_logic import DrMario, is_direct_input, parse_line_content, print_freeze_matches
+from dr_mario_backends import load_backend, selected_backend
 
-def main():
+def main(engine=DrMario, profiler: Optional['CommandProfiler'] = None):
     try:
-        game = DrMario()
+        game = engine()
         
         try:
             is_interactive = sys.stdin.isatty()
@@ -22,12 +27,12 @@ def main():
             return
 
         game.initialize(rows, cols)
+        game.event_listener = print_freeze_matches
+        if profiler is not None:
+            game.event_listener = profiler.wrap_listener(print_freeze_matches)
         
         if is_interactive:
             print("Game initialized. Enter commands (press Ctrl+D or type 'Q' to quit):")
-        
-        empty_count = 0
-        last_content_row = None
 
         while True:
             try:
@@ -36,21 +41,8 @@ def main():
                 break
 
             try:
-                if command == '':
-                    empty_count += 1
-                    game.pass_time()
-                    last_content_row = None
-                    
-                    if empty_count == 2 and game.faller and game.faller['state'] == 'falling':
-                        game.faller['state'] = 'landed'
-                        
-                    game.print_field()
-                elif command == 'Q':
+                if command == 'Q':
                     break
-                elif command == 'EMPTY':
-                    game.set_empty_field()
-                    last_content_row = None
-                    game.print_field()
                 elif command == 'CONTENTS':
                     lines = []
                     if is_interactive:
@@ -59,68 +51,24 @@ def main():
                         line = input().strip()
                         line = parse_line_content(line, cols)
                         lines.append(line)
-                    game.set_field_contents(lines)
-                    last_content_row = None
-                    game.print_field()
-                elif command.startswith('F '):
-                    parts = command.split()
-                    if len(parts) != 3:
-                        raise ValueError("F command requires two colors (e.g., 'F R Y')")
-                    game.spawn_faller(parts[1], parts[2])
-                    empty_count = 0
-                    last_content_row = None
-                    game.print_field()
-                    if game.is_game_over:
-                        break
-                elif command == 'A':
-                    game.rotate_faller(clockwise=True)
-                    game.print_field()
-                elif command == 'B':
-                    game.rotate_faller(clockwise=False)
-                    game.print_field()
-                elif command in ['<', '>']:
-                    direction = -1 if command == '<' else 1
-                    game.move_faller(direction)
-                    game.print_field()
-                elif command.startswith('V '):
-                    parts = command.split()
-                    if len(parts) != 4:
-                        raise ValueError("V command requires row, col, and color (e.g., 'V 3 4 R')")
-                    game.insert_virus(int(parts[1]), int(parts[2]), parts[3])
-                    last_content_row = None
-                    game.print_field()
-                elif all(c in 'RYBryb ' for c in command):
-                    content = parse_line_content(command, cols)
-                    current_field = [[''] * cols for _ in range(rows)]
-                    
-                    for r in range(rows):
-                        for c in range(cols):
-                            if game.field[r][c] != ' ':
-                                current_field[r][c] = game.field[r][c]
-                    
-                    target_row = 1
-                    
-                    for r in range(rows):
-                        if any(game.field[r][c] != ' ' for c in range(cols)):
-                            target_row = 3
-                            break
-                    
-                    for c in range(cols):
-                        if content[c] != ' ':
-                            current_field[target_row][c] = content[c]
-                    
-                    lines = []
-                    for r in range(rows):
-                        line = ''
-                        for c in range(cols):
-                            line += current_field[r][c] if current_field[r][c] != '' else ' '
-                        lines.append(line)
-                    
-                    game.set_field_contents(lines)
-                    game.print_field()
+                    started = time.perf_counter_ns()
+                    events = game.step(command, lines)
+                elif is_game_command(command):
+                    started = time.perf_counter_ns()
+                    events = game.step(command)
                 else:
                     if is_interactive:
                         print(f"Unknown command: {command}")
+                    continue
+
+                stepped = time.perf_counter_ns()
+                try:
+                    game.print_field()
+                finally:
+                    if profiler is not None:
+                        profiler.record(command, stepped - started, time.perf_counter_ns() - stepped)
+                if any(event['type'] == 'game_over' for event in events):
+                    break
             except Exception as e:
                 if is_interactive:
                     print(f"Error: {e}")
@@ -131,6 +79,200 @@ def main():
             print(f"Error: {e}")
         pass
 
+def command_kind(command: str) -> str:
+    if command == '':
+        return 'tick'
+    if command.startswith('F ') or command.startswith('V '):
+        return command[0]
+    if command in ('A', 'B', '<', '>', 'EMPTY', 'CONTENTS', 'instant drop'):
+        return command
+    return 'direct input'
+
+class CommandProfiler:
+    # Collects engine and render time per command kind for --profile.
+    # Frames printed by the event listener in the middle of a step count as
+    # render time, not engine time.
+    def __init__(self):
+        self.engine_ns: Dict[str, List[int]] = {}
+        self.render_ns: Dict[str, List[int]] = {}
+        self._listener_ns = 0
+
+    def wrap_listener(self, listener):
+        def timed(game, event):
+            start = time.perf_counter_ns()
+            try:
+                listener(game, event)
+            finally:
+                self._listener_ns += time.perf_counter_ns() - start
+        return timed
+
+    def record(self, command: str, engine_ns: int, render_ns: int):
+        kind = command_kind(command)
+        self.engine_ns.setdefault(kind, []).append(engine_ns - self._listener_ns)
+        self.render_ns.setdefault(kind, []).append(render_ns + self._listener_ns)
+        self._listener_ns = 0
+
+    def report(self, out=None):
+        out = out or sys.stderr
+        print(f"{'command':<14}{'count':>7}  {'engine p50/p95/p99 (us)':>26}  {'render p50/p95/p99 (us)':>26}"
+              f"  {'total (ms)':>10}", file=out)
+        for kind in sorted(self.engine_ns, key=lambda kind: -sum(self.engine_ns[kind]) - sum(self.render_ns[kind])):
+            engine = sorted(self.engine_ns[kind])
+            render = sorted(self.render_ns[kind])
+            total = (sum(engine) + sum(render)) / 1e6
+            print(f"{kind:<14}{len(engine):>7}  {_percentiles(engine):>26}  {_percentiles(render):>26}"
+                  f"  {total:>10.2f}", file=out)
+
+        # How the whole-command times are spread, in powers of ten
+        bounds = [10_000, 100_000, 1_000_000, 10_000_000]
+        labels = ['<10us', '<100us', '<1ms', '<10ms', '>=10ms']
+        counts = [0] * len(labels)
+        for kind in self.engine_ns:
+            for engine, render in zip(self.engine_ns[kind], self.render_ns[kind]):
+                counts[sum(engine + render >= bound for bound in bounds)] += 1
+        print('histogram: ' + '  '.join(f"{label} {count}" for label, count in zip(labels, counts)), file=out)
+
+def _percentiles(samples: List[int]) -> str:
+    # Nearest-rank p50/p95/p99 of sorted samples, in microseconds
+    picks = [samples[min(len(samples) - 1, max(0, -(-len(samples) * p // 100) - 1))] for p in (50, 95, 99)]
+    return '/'.join(f"{ns / 1000:.1f}" for ns in picks)
+
+def is_game_command(command: str) -> bool:
+    return command in ['', 'EMPTY', 'A', 'B', '<', '>', 'instant drop'] or command.startswith('F ') or \
+        command.startswith('V ') or is_direct_input(command)
+
+# Opcodes for batch mode, see parse_script
+OP_TICK = 0
+OP_MOVE = 1
+OP_ROTATE = 2
+OP_FALLER = 3
+OP_VIRUS = 4
+OP_DIRECT = 5
+OP_CONTENTS = 6
+OP_EMPTY = 7
+OP_QUIT = 8
+OP_DROP = 9
+
+def parse_script(lines: List[str], rows: int, cols: int) -> List[tuple]:
+    # Turns the command lines that follow the board size into opcodes.
+    # Commands that main() would reject without touching the game are
+    # dropped here, so run_script never has to re-check them.
+    ops = []
+    i = 0
+    while i < len(lines):
+        command = lines[i].strip()
+        i += 1
+
+        if command == '':
+            ops.append((OP_TICK,))
+        elif command == 'Q':
+            ops.append((OP_QUIT,))
+            break
+        elif command == 'EMPTY':
+            ops.append((OP_EMPTY,))
+        elif command == 'CONTENTS':
+            if i + rows > len(lines):
+                # main() runs out of input part way through the contents
+                break
+            ops.append((OP_CONTENTS, [parse_line_content(line.strip(), cols) for line in lines[i:i + rows]]))
+            i += rows
+        elif command.startswith('F '):
+            parts = command.split()
+            if len(parts) == 3:
+                ops.append((OP_FALLER, parts[1], parts[2]))
+        elif command == 'A' or command == 'B':
+            ops.append((OP_ROTATE, command == 'A'))
+        elif command in ['<', '>']:
+            ops.append((OP_MOVE, -1 if command == '<' else 1))
+        elif command == 'instant drop':
+            ops.append((OP_DROP,))
+        elif command.startswith('V '):
+            parts = command.split()
+            try:
+                if len(parts) == 4:
+                    ops.append((OP_VIRUS, int(parts[1]), int(parts[2]), parts[3]))
+            except ValueError:
+                pass
+        elif is_direct_input(command):
+            ops.append((OP_DIRECT, command))
+    return ops
+
+def run_script(game, ops: List[tuple]):
+    for op in ops:
+        code = op[0]
+        try:
+            if code == OP_TICK:
+                game.tick()
+            elif code == OP_MOVE:
+                game.move_faller(op[1])
+            elif code == OP_ROTATE:
+                game.rotate_faller(clockwise=op[1])
+            elif code == OP_FALLER:
+                game.spawn_faller(op[1], op[2])
+                game.print_field()
+                if game.is_game_over:
+                    break
+                continue
+            elif code == OP_VIRUS:
+                game.insert_virus(op[1], op[2], op[3])
+            elif code == OP_DIRECT:
+                game.apply_direct_input(op[1])
+            elif code == OP_CONTENTS:
+                game.set_field_contents(op[1])
+            elif code == OP_EMPTY:
+                game.set_empty_field()
+            elif code == OP_DROP:
+                game.hard_drop()
+            else:
+                break
+            game.print_field()
+        except Exception:
+            pass
+
+def batch_main(path: Optional[str] = None, engine=DrMario):
+    # Non-interactive equivalent of main(): the whole script is read up
+    # front and all output is written in one go at the end.
+    if path is None:
+        text = sys.stdin.read()
+    else:
+        with open(path) as f:
+            text = f.read()
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        run_batch(split_script(text), engine)
+    sys.stdout.write(out.getvalue())
+    sys.stdout.flush()
+
+def split_script(text: str) -> List[str]:
+    # The lines input() would return, one by one, for this text
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+def run_batch(lines: List[str], engine=DrMario):
+    # Runs a whole script, printing as main() would, and returns the game
+    # (None if the board size could not be read)
+    try:
+        if not lines:
+            return None
+        rows = int(lines[0].strip())
+        if len(lines) < 2:
+            return None
+        cols = int(lines[1].strip())
+        if rows <= 0 or cols <= 0:
+            raise ValueError("Dimensions must be positive numbers")
+    except ValueError as e:
+        print(f"Error: {e}")
+        return None
+
+    game = engine()
+    game.initialize(rows, cols)
+    game.event_listener = print_freeze_matches
+    run_script(game, parse_script(lines[2:], rows, cols))
+    return game
+
 def test_game():
     # Initialize game with test case
     game = DrMario()
@@ -160,7 +302,25 @@ def test_game():
     game.print_field()
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+    args = sys.argv[1:]
+    # --engine NAME or $DR_MARIO_ENGINE; --bitboard is short for --engine
+    # bitboard, so it also beats the environment
+    try:
+        engine = load_backend(selected_backend(['--engine', 'bitboard'] if '--bitboard' in args else args))
+    except ValueError as e:
+        sys.exit(f"a2.py: {e}")
+
+    if '--test' in args:
         test_game()
+    elif '--batch' in args:
+        # --batch reads stdin, --batch FILE reads the script from FILE
+        i = args.index('--batch')
+        path = args[i + 1] if i + 1 < len(args) and not args[i + 1].startswith('--') else None
+        batch_main(path, engine)
+    elif '--profile' in args:
+        # Timings go to stderr so stdout is the same as without --profile
+        profiler = CommandProfiler()
+        main(engine, profiler)
+        profiler.report()
     else:
-        main()
+        main(engine)
@@ -27,16 +27,25 @@
 # YOU DO NOT NEED TO READ OR UNDERSTAND THIS CODE, though can you certainly
 # feel free to take a look at it.
 
+import argparse
+import gc
+import importlib
+import io
 import locale
+import os
 import pathlib
 import queue
+import signal
+import socket
 import subprocess
 import sys
+import tempfile
 import threading
 import time
 import traceback
 import typing
-from typing import List, Union, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Union, Iterable
 
 
 class TextProcessReadTimeout(Exception):
@@ -45,8 +54,7 @@ class TextProcessReadTimeout(Exception):
 
 
 class TextProcess:
-    _READ_INTERVAL_IN_SECONDS = 0.025
-
+    _JOIN_TIMEOUT_IN_SECONDS = 2.0
 
     def __init__(self, args: List[str], working_directory: str):
         self._process = subprocess.Popen(
@@ -54,7 +62,8 @@ class TextProcess:
             stdin = subprocess.PIPE, stdout = subprocess.PIPE,
             stderr = subprocess.STDOUT)
 
-        self._stdout_read_trigger = queue.Queue()
+        # The reader thread streams stdout into this queue as it arrives,
+        # ending with None at end of file (or the exception that stopped it)
         self._stdout_buffer = queue.Queue()
 
         self._stdout_thread = threading.Thread(
@@ -72,9 +81,12 @@ class TextProcess:
 
 
     def close(self):
-        self._stdout_read_trigger.put('stop')
         self._process.terminate()
         self._process.wait()
+
+        # The reader must be done with the pipe before it is closed, or it
+        # can go on reading whatever the descriptor is reused for next
+        self._stdout_thread.join(TextProcess._JOIN_TIMEOUT_IN_SECONDS)
         self._process.stdout.close()
         self._process.stdin.close()
 
@@ -89,53 +101,353 @@ class TextProcess:
 
 
     def read_line(self, timeout: float = None) -> str or None:
-        self._stdout_read_trigger.put('read')
-        
-        sleep_time = 0
-        
-        while timeout == None or sleep_time < timeout:
-            try:
-                next_result = self._stdout_buffer.get_nowait()
+        try:
+            next_result = self._stdout_buffer.get(timeout = timeout)
 
-                if next_result == None:
-                    return None
-                elif isinstance(next_result, Exception):
-                    raise next_result
-                else:
-                    line = next_result.decode(locale.getpreferredencoding(False))
+        except queue.Empty:
+            raise TextProcessReadTimeout()
 
-                    if line.endswith('\r\n'):
-                        line = line[:-2]
-                    elif line.endswith('\n'):
-                        line = line[:-1]
+        if next_result == None or isinstance(next_result, Exception):
+            # The reader has stopped; every later read gets the same answer
+            self._stdout_buffer.put(next_result)
 
-                    return line
+        if next_result == None:
+            return None
+        elif isinstance(next_result, Exception):
+            raise next_result
+        else:
+            line = next_result.decode(locale.getpreferredencoding(False))
 
-            except queue.Empty:
-                time.sleep(TextProcess._READ_INTERVAL_IN_SECONDS)
-                sleep_time += TextProcess._READ_INTERVAL_IN_SECONDS
+            if line.endswith('\r\n'):
+                line = line[:-2]
+            elif line.endswith('\n'):
+                line = line[:-1]
 
-        raise TextProcessReadTimeout()
+            return line
 
 
     def _stdout_read_loop(self):
         try:
-            while self._process.returncode == None:
-                if self._stdout_read_trigger.get() == 'read':
-                    line = self._process.stdout.readline()
+            for line in iter(self._process.stdout.readline, b''):
+                self._stdout_buffer.put(line)
 
-                    if line == b'':
-                        self._stdout_buffer.put(None)
-                    else:
-                        self._stdout_buffer.put(line)
-                else:
-                    break
+            self._stdout_buffer.put(None)
 
         except Exception as e:
             self._stdout_buffer.put(e)
 
 
 
+class _ThreadLocalStream:
+    # Stands in for sys.stdin, sys.stdout or sys.stderr and forwards to the
+    # stream registered for the current thread, or to the real one
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+
+    def set(self, stream) -> None:
+        self._local.stream = stream
+
+
+    def __getattr__(self, name):
+        return getattr(getattr(self._local, 'stream', None) or self._default, name)
+
+
+
+_thread_streams_lock = threading.Lock()
+
+
+def _install_thread_streams() -> None:
+    with _thread_streams_lock:
+        if not isinstance(sys.stdin, _ThreadLocalStream):
+            sys.stdin = _ThreadLocalStream(sys.stdin)
+            sys.stdout = _ThreadLocalStream(sys.stdout)
+            sys.stderr = _ThreadLocalStream(sys.stderr)
+
+
+
+class _QueueReader:
+    # stdin for an in-process program: lines written by the checker, then
+    # end of file once it is closed
+    def __init__(self):
+        self._lines = queue.Queue()
+
+
+    def feed(self, line: Union[str, None]) -> None:
+        self._lines.put(line)
+
+
+    def readline(self, size: int = -1) -> str:
+        line = self._lines.get()
+
+        if line == None:
+            self._lines.put(None)
+            return ''
+
+        return line
+
+
+    def isatty(self) -> bool:
+        return False
+
+
+
+class _QueueWriter:
+    # stdout for an in-process program: complete lines go to the checker's
+    # queue as the bytes a real process would have written
+    def __init__(self, lines: queue.Queue):
+        self._lines = lines
+        self._partial = ''
+
+
+    def write(self, text: str) -> int:
+        self._partial += text
+        *complete, self._partial = self._partial.split('\n')
+
+        for line in complete:
+            self._lines.put((line + '\n').encode(locale.getpreferredencoding(False)))
+
+        return len(text)
+
+
+    def flush(self) -> None:
+        pass
+
+
+    def isatty(self) -> bool:
+        return False
+
+
+    def close(self) -> None:
+        if self._partial:
+            self._lines.put(self._partial.encode(locale.getpreferredencoding(False)))
+            self._partial = ''
+
+        self._lines.put(None)
+
+
+
+class InProcessTextProcess(TextProcess):
+    # Runs the program's main() on a thread of this process, with its
+    # stdin, stdout and stderr swapped for in-memory streams, so there is
+    # no interpreter to start.  Reading works exactly as for TextProcess.
+    _JOIN_TIMEOUT_IN_SECONDS = 2.0
+
+
+    def __init__(self, module_name: str = 'a2'):
+        _install_thread_streams()
+        self._main = importlib.import_module(module_name).main
+        self._stdin = _QueueReader()
+        self._stdout_buffer = queue.Queue()
+
+        self._stdout_thread = threading.Thread(
+            target = self._run_main, daemon = True)
+
+        self._stdout_thread.start()
+
+
+    def close(self):
+        self._stdin.feed(None)
+        self._stdout_thread.join(InProcessTextProcess._JOIN_TIMEOUT_IN_SECONDS)
+
+
+    def write_line(self, line: str) -> None:
+        self._stdin.feed(line + '\n')
+
+
+    def _run_main(self):
+        writer = _QueueWriter(self._stdout_buffer)
+        sys.stdin.set(self._stdin)
+        sys.stdout.set(writer)
+        sys.stderr.set(writer)
+
+        try:
+            self._main()
+
+        except SystemExit:
+            pass
+
+        except BaseException:
+            # What the interpreter would have printed on the way out
+            writer.write(traceback.format_exc())
+
+        finally:
+            writer.close()
+            sys.stdin.set(None)
+            sys.stdout.set(None)
+            sys.stderr.set(None)
+
+
+
+class _ForkedChild:
+    # The parts of a Popen that TextProcess uses, for a child of the fork
+    # server.  It is not our child, so it cannot be waited for; its stdout
+    # reaching end of file is what tells us it has gone.
+    def __init__(self, pid: int, stdin, stdout):
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+
+
+    def terminate(self) -> None:
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+
+        except ProcessLookupError:
+            pass
+
+
+
+class ForkedTextProcess(TextProcess):
+    _JOIN_TIMEOUT_IN_SECONDS = 2.0
+
+
+    def __init__(self, pid: int, stdin_fd: int, stdout_fd: int):
+        self._process = _ForkedChild(
+            pid, open(stdin_fd, 'wb', buffering = 0), open(stdout_fd, 'rb', buffering = 0))
+
+        self._stdout_buffer = queue.Queue()
+
+        self._stdout_thread = threading.Thread(
+            target = self._stdout_read_loop, daemon = True)
+
+        self._stdout_thread.start()
+
+
+    def close(self):
+        self._process.terminate()
+        self._stdout_thread.join(ForkedTextProcess._JOIN_TIMEOUT_IN_SECONDS)
+        self._process.stdout.close()
+        self._process.stdin.close()
+
+
+
+class ForkServer:
+    # One interpreter that has imported the program (and so everything it
+    # imports) once, then forks a fresh copy of itself for each launch, with
+    # stdin, stdout and stderr on pipes passed over a Unix socket.  Each
+    # launch costs a fork instead of an interpreter start and the imports.
+    def __init__(self, module_name: str = 'a2'):
+        self._socket, server_socket = socket.socketpair()
+        self._lock = threading.Lock()
+
+        self._server = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--fork-server-for', module_name],
+            cwd = str(pathlib.Path.cwd()), stdin = server_socket.fileno(),
+            stdout = subprocess.DEVNULL)
+
+        server_socket.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, tr, exc, val):
+        self.close()
+
+
+    def close(self) -> None:
+        self._socket.close()
+        self._server.wait()
+
+
+    def launch(self) -> TextProcess:
+        stdin_read, stdin_write = os.pipe()
+        stdout_read, stdout_write = os.pipe()
+
+        try:
+            with self._lock:
+                socket.send_fds(self._socket, [b'L'], [stdin_read, stdout_write])
+                reply = self._socket.recv(16)
+
+        finally:
+            os.close(stdin_read)
+            os.close(stdout_write)
+
+        if not reply:
+            os.close(stdin_write)
+            os.close(stdout_read)
+            raise TestFailure()
+
+        return ForkedTextProcess(int(reply), stdin_write, stdout_read)
+
+
+
+def _serve_forks(module_name: str) -> None:
+    # The fork server's side: the socket arrives as stdin
+    control = socket.socket(fileno = 0)
+    module_path = str(pathlib.Path.cwd() / (module_name + '.py'))
+    sys.path.insert(0, str(pathlib.Path.cwd()))
+    importlib.import_module(module_name)
+
+    with open(module_path, 'rb') as module_file:
+        code = compile(module_file.read(), module_path, 'exec')
+
+    # Children are reaped as they exit
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    # Keeps the collector from touching (and so copying) the pages every
+    # child shares with the server
+    gc.freeze()
+
+    while True:
+        message, fds, _, _ = socket.recv_fds(control, 1, 2)
+
+        if not message:
+            break
+
+        pid = os.fork()
+
+        if pid == 0:
+            control.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            os.dup2(fds[0], 0)
+            os.dup2(fds[1], 1)
+            os.dup2(fds[1], 2)
+
+            for fd in fds:
+                os.close(fd)
+
+            os._exit(_run_forked_module(module_path, code))
+
+        for fd in fds:
+            os.close(fd)
+
+        control.sendall(str(pid).encode('ascii'))
+
+
+def _run_forked_module(module_path: str, code) -> int:
+    # Runs the module as `python module_path` would, returning its exit status
+    sys.argv = [module_path]
+    status = 0
+
+    try:
+        exec(code, {'__name__': '__main__', '__file__': module_path, '__builtins__': __builtins__})
+
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            status = e.code
+        elif e.code != None:
+            print(e.code, file = sys.stderr)
+            status = 1
+
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    except OSError:
+        pass
+
+    return status
+
+
+
 class TestFailure(Exception):
     pass
 
@@ -242,11 +554,11 @@ class TestEndOfOutput:
 
 
 
-def run_test() -> None:
+def run_test(launch: Callable[[], TextProcess] = None) -> None:
     process = None
 
     try:
-        process = start_process()
+        process = (launch or start_process)()
         test_lines = make_test_lines()
         run_test_lines(process, test_lines)
 
@@ -267,13 +579,13 @@ def run_test() -> None:
 
 
 
-def start_process() -> TextProcess:
-    module_path = pathlib.Path.cwd() / 'a2.py'
+def start_process(module_name: str = 'a2') -> TextProcess:
+    module_path = pathlib.Path.cwd() / (module_name + '.py')
 
     if not module_path.exists() or not module_path.is_file():
         print_labeled_output(
             'ERROR',
-            'Cannot find an executable "a2.py" file in this directory.',
+            'Cannot find an executable "{}" file in this directory.'.format(module_path.name),
             'Make sure that the sanity checker is in the same directory as the',
             'files that comprise your Assignment #2 solution.')
 
@@ -286,18 +598,24 @@ def start_process() -> TextProcess:
 
 
 
+# Scenarios run side by side on threads, so each thread can send the
+# labeled output to its own log instead of stdout
+_labeled_output = threading.local()
+
+
 def print_labeled_output(label: str, *msg_lines: typing.Iterable[str]) -> None:
+    out = getattr(_labeled_output, 'stream', None)
     showed_first = False
 
     for msg_line in msg_lines:
         if not showed_first:
-            print('{:10}|{}'.format(label, msg_line))
+            print('{:10}|{}'.format(label, msg_line), file = out)
             showed_first = True
         else:
-            print('{:10}|{}'.format(' ', msg_line))
+            print('{:10}|{}'.format(' ', msg_line), file = out)
 
     if not showed_first:
-        print(label)
+        print(label, file = out)
 
 
 
@@ -360,5 +678,229 @@ def run_test_lines(process: TextProcess, test_lines: 'TestLine') -> None:
 
 
 
+# Scenario files hold one test line per line of text:
+#
+#   < text        input line (a lone '<' is an empty line)
+#   > text        expected output line
+#   timeout 5.0   timeout for the output lines that follow (default 10)
+#   end 2.0       expect no more output within 2 seconds
+#   # ...         comment
+#
+# Only the single space after '<' or '>' is a separator; the rest of the
+# line, trailing spaces included, is the text.
+
+_DEFAULT_TIMEOUT_IN_SECONDS = 10.0
+
+
+def load_scenario(path: str) -> List['TestLine']:
+    test_lines = []
+    timeout = _DEFAULT_TIMEOUT_IN_SECONDS
+
+    with open(path, encoding = 'utf-8') as scenario_file:
+        for number, line in enumerate(scenario_file, start = 1):
+            line = line.rstrip('\r\n')
+
+            if line.startswith('<'):
+                test_lines.append(TestInputLine(line[2:]))
+            elif line.startswith('>'):
+                test_lines.append(TestOutputLine(line[2:], timeout))
+            elif line.startswith('timeout '):
+                timeout = float(line.split()[1])
+            elif line.startswith('end '):
+                test_lines.append(TestEndOfOutput(float(line.split()[1])))
+            elif line.strip() == '' or line.startswith('#'):
+                continue
+            else:
+                raise ValueError('{}:{}: cannot parse {!r}'.format(path, number, line))
+
+    return test_lines
+
+
+
+def save_scenario(test_lines: List['TestLine'], path: str) -> None:
+    timeout = _DEFAULT_TIMEOUT_IN_SECONDS
+
+    with open(path, 'w', encoding = 'utf-8') as scenario_file:
+        for test_line in test_lines:
+            if isinstance(test_line, TestInputLine):
+                scenario_file.write('< {}\n'.format(test_line._text))
+            elif isinstance(test_line, TestOutputLine):
+                if test_line._timeout_in_seconds != timeout:
+                    timeout = test_line._timeout_in_seconds
+                    scenario_file.write('timeout {}\n'.format(timeout))
+                scenario_file.write('> {}\n'.format(test_line._text))
+            else:
+                scenario_file.write('end {}\n'.format(test_line._timeout_in_seconds))
+
+
+
+def find_scenarios(paths: List[str]) -> List[str]:
+    scenarios = []
+
+    for path in paths:
+        p = pathlib.Path(path)
+
+        if p.is_dir():
+            scenarios.extend(str(s) for s in sorted(p.glob('*.txt')))
+        else:
+            scenarios.append(str(p))
+
+    return scenarios
+
+
+
+def run_scenario(path: str, launch: Callable[[], TextProcess] = None) -> dict:
+    # Runs one scenario file against a fresh process from launch() and
+    # returns whether it passed, how long it took and its labeled output
+    log = io.StringIO()
+    _labeled_output.stream = log
+    process = None
+    passed = False
+    start = time.perf_counter()
+
+    try:
+        test_lines = load_scenario(path)
+        process = (launch or start_process)()
+        run_test_lines(process, test_lines)
+        passed = True
+
+    except TestFailure:
+        pass
+
+    except Exception:
+        print_labeled_output(
+            'EXCEPTION',
+            *[tb_line.rstrip() for tb_line in traceback.format_exc().split('\n')])
+
+    finally:
+        if process != None:
+            process.close()
+
+        _labeled_output.stream = None
+
+    return {
+        'scenario': path,
+        'passed': passed,
+        'seconds': time.perf_counter() - start,
+        'log': log.getvalue()
+    }
+
+
+
+def run_scenarios(paths: List[str], jobs: int, launch: Callable[[], TextProcess] = None,
+                  verbose: bool = False) -> bool:
+    # At most `jobs` programs run at once, one per worker thread
+    scenarios = find_scenarios(paths)
+    start = time.perf_counter()
+    failures = 0
+
+    with ThreadPoolExecutor(max_workers = max(1, jobs)) as pool:
+        for result in pool.map(lambda path: run_scenario(path, launch), scenarios):
+            label = 'PASSED' if result['passed'] else 'FAILED'
+            print_labeled_output(label, '{} ({:.3f}s)'.format(result['scenario'], result['seconds']))
+
+            if not result['passed']:
+                failures += 1
+
+            if verbose or not result['passed']:
+                sys.stdout.write(result['log'])
+
+    print_labeled_output(
+        'SUMMARY',
+        '{} of {} scenarios passed in {:.2f}s with {} jobs'.format(
+            len(scenarios) - failures, len(scenarios), time.perf_counter() - start, jobs))
+
+    return failures == 0
+
+
+
+def check_isolation(rounds: int = 100, good: int = 2, jobs: int = 1,
+                    launch: Callable[[], TextProcess] = None) -> int:
+    # Runs a failing scenario followed by passing ones, `rounds` times, and
+    # counts the scenarios whose result was not the expected one.  A program
+    # left running (or a pipe left being read) by the failing scenario would
+    # show up as a failure in one that follows it.
+    broken_lines = [TestInputLine('40'), TestInputLine('40'), TestInputLine('EMPTY'),
+                    TestOutputLine('|   broken   |', 10.0)]
+    failures = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        broken_path = os.path.join(directory, 'broken.txt')
+        save_scenario(broken_lines, broken_path)
+        paths = [broken_path]
+
+        for i in range(good):
+            paths.append(os.path.join(directory, 'good{:03}.txt'.format(i)))
+            save_scenario(make_test_lines(), paths[-1])
+
+        with ThreadPoolExecutor(max_workers = max(1, jobs)) as pool:
+            for _ in range(rounds):
+                for result in pool.map(lambda path: run_scenario(path, launch), paths):
+                    if result['passed'] == (result['scenario'] == broken_path):
+                        failures += 1
+
+    return failures
+
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description = 'Run the built-in scenario, or check a2.py against scenario files.')
+    parser.add_argument('scenarios', nargs = '*',
+                        help = 'scenario files or directories of *.txt scenario files')
+    parser.add_argument('--jobs', type = int, default = os.cpu_count() or 1,
+                        help = 'scenarios to run at once')
+    parser.add_argument('--verbose', action = 'store_true',
+                        help = 'show the output of passing scenarios too')
+    parser.add_argument('--save-builtin', metavar = 'FILE',
+                        help = 'write the built-in scenario to FILE and exit')
+    parser.add_argument('--module', default = 'a2',
+                        help = 'program to check, as a module name in this directory (a2 or a3)')
+    parser.add_argument('--in-process', action = 'store_true',
+                        help = 'run main() inside the checker instead of a new interpreter')
+    parser.add_argument('--fork-server', action = 'store_true',
+                        help = 'fork each program from one interpreter that has already imported it')
+    parser.add_argument('--check', action = 'store_true',
+                        help = 'check that a failing scenario does not affect the ones after it')
+    parser.add_argument('--fork-server-for', help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fork_server_for:
+        _serve_forks(args.fork_server_for)
+        return
+
+    fork_server = None
+
+    if args.in_process:
+        # Modules are imported from the directory being checked, as
+        # start_process() runs them from there
+        sys.path.insert(0, str(pathlib.Path.cwd()))
+        launch = lambda: InProcessTextProcess(args.module)
+    elif args.fork_server:
+        # start_process() reports a missing module before the server starts
+        start_process(args.module).close()
+        fork_server = ForkServer(args.module)
+        launch = fork_server.launch
+    else:
+        launch = lambda: start_process(args.module)
+
+    try:
+        if args.check:
+            failures = check_isolation(jobs = args.jobs, launch = launch)
+            print_labeled_output('CHECK', 'scenarios with the wrong result: {}'.format(failures))
+            sys.exit(0 if failures == 0 else 1)
+        elif args.save_builtin:
+            save_scenario(make_test_lines(), args.save_builtin)
+        elif args.scenarios:
+            sys.exit(0 if run_scenarios(args.scenarios, args.jobs, launch, args.verbose) else 1)
+        else:
+            run_test(launch)
+
+    finally:
+        if fork_server != None:
+            fork_server.close()
+
+
+
 if __name__ == '__main__':
-    run_test()
+    main()
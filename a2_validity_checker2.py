@@ -33,7 +33,6 @@ import queue
 import subprocess
 import sys
 import threading
-import time
 import traceback
 import typing
 from typing import List, Union, Iterable
@@ -45,8 +44,7 @@ class TextProcessReadTimeout(Exception):
 
 
 class TextProcess:
-    _READ_INTERVAL_IN_SECONDS = 0.025
-
+    _JOIN_TIMEOUT_IN_SECONDS = 2.0
 
     def __init__(self, args: List[str], working_directory: str):
         self._process = subprocess.Popen(
@@ -54,7 +52,8 @@ class TextProcess:
             stdin = subprocess.PIPE, stdout = subprocess.PIPE,
             stderr = subprocess.STDOUT)
 
-        self._stdout_read_trigger = queue.Queue()
+        # The reader thread streams stdout into this queue as it arrives,
+        # ending with None at end of file (or the exception that stopped it)
         self._stdout_buffer = queue.Queue()
 
         self._stdout_thread = threading.Thread(
@@ -72,9 +71,12 @@ class TextProcess:
 
 
     def close(self):
-        self._stdout_read_trigger.put('stop')
         self._process.terminate()
         self._process.wait()
+
+        # The reader must be done with the pipe before it is closed, or it
+        # can go on reading whatever the descriptor is reused for next
+        self._stdout_thread.join(TextProcess._JOIN_TIMEOUT_IN_SECONDS)
         self._process.stdout.close()
         self._process.stdin.close()
 
@@ -89,47 +91,37 @@ class TextProcess:
 
 
     def read_line(self, timeout: float = None) -> str or None:
-        self._stdout_read_trigger.put('read')
-        
-        sleep_time = 0
-        
-        while timeout == None or sleep_time < timeout:
-            try:
-                next_result = self._stdout_buffer.get_nowait()
+        try:
+            next_result = self._stdout_buffer.get(timeout = timeout)
 
-                if next_result == None:
-                    return None
-                elif isinstance(next_result, Exception):
-                    raise next_result
-                else:
-                    line = next_result.decode(locale.getpreferredencoding(False))
+        except queue.Empty:
+            raise TextProcessReadTimeout()
 
-                    if line.endswith('\r\n'):
-                        line = line[:-2]
-                    elif line.endswith('\n'):
-                        line = line[:-1]
+        if next_result == None or isinstance(next_result, Exception):
+            # The reader has stopped; every later read gets the same answer
+            self._stdout_buffer.put(next_result)
 
-                    return line
+        if next_result == None:
+            return None
+        elif isinstance(next_result, Exception):
+            raise next_result
+        else:
+            line = next_result.decode(locale.getpreferredencoding(False))
 
-            except queue.Empty:
-                time.sleep(TextProcess._READ_INTERVAL_IN_SECONDS)
-                sleep_time += TextProcess._READ_INTERVAL_IN_SECONDS
+            if line.endswith('\r\n'):
+                line = line[:-2]
+            elif line.endswith('\n'):
+                line = line[:-1]
 
-        raise TextProcessReadTimeout()
+            return line
 
 
     def _stdout_read_loop(self):
         try:
-            while self._process.returncode == None:
-                if self._stdout_read_trigger.get() == 'read':
-                    line = self._process.stdout.readline()
-
-                    if line == b'':
-                        self._stdout_buffer.put(None)
-                    else:
-                        self._stdout_buffer.put(line)
-                else:
-                    break
+            for line in iter(self._process.stdout.readline, b''):
+                self._stdout_buffer.put(line)
+
+            self._stdout_buffer.put(None)
 
         except Exception as e:
             self._stdout_buffer.put(e)
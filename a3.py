@@ -1,4 +1,4 @@
-from dr_mario import DrMario
+from dr_mario import DrMario, print_freeze_matches
 import sys
 
 def parse_line_content(line: str, cols: int) -> str:
@@ -32,6 +32,7 @@ def main():
             return
 
         game.initialize(rows, cols)
+        game.event_listener = print_freeze_matches
         
         if is_interactive:
             print("Game initialized. Enter commands (press Ctrl+D or type 'Q' to quit):")
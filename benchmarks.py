@@ -0,0 +1,256 @@
+# benchmarks.py
+#
+# Times the engine hot paths (set_field_contents, find_matches,
+# apply_gravity, pass_time, print_field) for dr_mario.DrMario and
+# dr_mario_logic.DrMario over a grid of board sizes and fill densities,
+# writes the results as JSON, and optionally compares them with a baseline
+# run from the same machine.
+#
+#   python benchmarks.py [--sizes 4x4,16x8,...] [--densities 0.25,...]
+#                        [--repeats 5] [--out FILE] [--baseline FILE]
+#                        [--threshold 0.10]
+#
+# Each case builds a fresh board (not timed) and times one call, repeating
+# until its share of --budget seconds is used (at least three samples
+# unless a single call takes longer than that).  The whole grid is run
+# --repeats times over, so each case is timed in rounds spread across the
+# run rather than all at once.  Results record the fastest and median
+# sample and the median of each round, in nanoseconds.  With --baseline, a
+# case counts as a regression, and the exit status is 1, only when every
+# round is more than --threshold slower than every round of the baseline;
+# one slow round, or rounds that overlap, are noise.
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import dr_mario
+import dr_mario_logic
+
+ENGINES = {
+    'dr_mario': dr_mario.DrMario,
+    'dr_mario_logic': dr_mario_logic.DrMario
+}
+OPERATIONS = ('set_field_contents', 'find_matches', 'apply_gravity', 'pass_time', 'print_field')
+SIZES = ((4, 4), (16, 8), (64, 32), (256, 256), (1000, 1000))
+DENSITIES = (0.0, 0.25, 0.5)
+
+
+def random_layout(rows: int, cols: int, density: float, seed: int = 0) -> List[str]:
+    # CONTENTS lines with the top two rows left empty for the faller
+    rnd = random.Random(f'{rows}x{cols}:{density}:{seed}')
+    return [' ' * cols if r < 2 else
+            ''.join(rnd.choice('RYBryb') if rnd.random() < density else ' ' for _ in range(cols))
+            for r in range(rows)]
+
+
+def _new_game(engine, rows: int, cols: int, lines: List[str]):
+    game = engine()
+    game.initialize(rows, cols)
+    game.set_field_contents(lines)
+    return game
+
+
+def _cases(engine, rows: int, cols: int, density: float) -> Dict[str, Tuple[Callable, Callable]]:
+    # operation -> (setup, timed call on what setup returned)
+    layout = random_layout(rows, cols, density)
+    other = random_layout(rows, cols, density, seed=1)
+
+    def fresh():
+        return _new_game(engine, rows, cols, layout)
+
+    def warm():
+        # pass_time is timed as a steady-state tick, after one tick has run
+        game = fresh()
+        game.pass_time()
+        return game
+
+    def empty():
+        game = engine()
+        game.initialize(rows, cols)
+        game.set_field_contents(other)
+        return game
+
+    return {
+        'set_field_contents': (empty, lambda game: game.set_field_contents(layout)),
+        'find_matches': (fresh, lambda game: game.find_matches()),
+        'apply_gravity': (fresh, lambda game: game.apply_gravity()),
+        'pass_time': (warm, lambda game: game.pass_time()),
+        'print_field': (fresh, _print_field)
+    }
+
+
+def _print_field(game):
+    try:
+        game.print_field()
+    except IndexError:
+        # Boards under four rows fail after printing, as in a2.py
+        pass
+
+
+def measure(setup: Callable, call: Callable, budget: float) -> List[int]:
+    samples = []
+    spent = 0.0
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        while True:
+            state = setup()
+            start = time.perf_counter_ns()
+            call(state)
+            elapsed = time.perf_counter_ns() - start
+            samples.append(elapsed)
+            spent += elapsed / 1e9
+            if spent >= budget and (len(samples) >= 3 or samples[0] / 1e9 >= budget):
+                return samples
+
+
+def run_suite(engines: List[str], operations: List[str], sizes: List[Tuple[int, int]],
+              densities: List[float], budget: float = 0.2, max_seconds: float = 30.0,
+              repeats: int = 5) -> dict:
+    results = []
+    samples: Dict[tuple, List[int]] = {}
+    all_cases: Dict[tuple, dict] = {}
+    for round_number in range(repeats):
+        index = 0
+        for engine_name in engines:
+            engine = ENGINES[engine_name]
+            for density in densities:
+                # Seconds per cell of the last size each operation ran at, to
+                # skip sizes that would take longer than max_seconds per sample
+                per_cell: Dict[str, float] = {}
+                for rows, cols in sorted(sizes, key=lambda size: size[0] * size[1]):
+                    key = (engine_name, rows, cols, density)
+                    if key not in all_cases:
+                        all_cases[key] = _cases(engine, rows, cols, density)
+                    cases = all_cases[key]
+                    for operation in operations:
+                        if round_number == 0:
+                            results.append({'engine': engine_name, 'operation': operation,
+                                            'rows': rows, 'cols': cols, 'density': density})
+                        result = results[index]
+                        index += 1
+                        # Which cases to skip is settled in the first round
+                        estimate = per_cell.get(operation, 0.0) * rows * cols
+                        if round_number == 0 and estimate > max_seconds:
+                            result['skipped'] = f"estimated {estimate:.0f}s per call"
+                        if 'skipped' not in result:
+                            setup, call = cases[operation]
+                            round_samples = measure(setup, call, budget / repeats)
+                            all_samples = samples.setdefault(_key(result), [])
+                            all_samples.extend(round_samples)
+                            result.update({'samples': len(all_samples), 'min_ns': min(all_samples),
+                                           'median_ns': int(statistics.median(all_samples))})
+                            result.setdefault('round_medians_ns', []).append(
+                                int(statistics.median(round_samples)))
+                            per_cell[operation] = min(round_samples) / 1e9 / (rows * cols)
+                        if round_number == repeats - 1:
+                            print(_format_result(result), file=sys.stderr)
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'repeats': repeats,
+        'results': results
+    }
+
+
+def _key(result: dict) -> tuple:
+    return (result['engine'], result['operation'], result['rows'], result['cols'], result['density'])
+
+
+def _format_result(result: dict) -> str:
+    name = f"{result['engine']:15} {result['operation']:19} {result['rows']}x{result['cols']:<5} " \
+           f"{result['density']:.2f}"
+    if 'skipped' in result:
+        return f"{name}  skipped ({result['skipped']})"
+    return f"{name}  {result['min_ns'] / 1000:12.1f} us  (median {result['median_ns'] / 1000:.1f}, " \
+           f"{result['samples']} samples)"
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[dict]:
+    # Cases whose fastest round is more than threshold (0.10 = 10%) slower
+    # than the slowest round of the baseline.  ratio compares the medians
+    # of the rounds.  Baselines without rounds count as one round.
+    previous = {_key(result): result for result in baseline['results'] if 'min_ns' in result}
+    regressions = []
+    for result in report['results']:
+        old: Optional[dict] = previous.get(_key(result))
+        if old is None or 'min_ns' not in result:
+            continue
+        old_rounds = old.get('round_medians_ns', [old['median_ns']])
+        new_rounds = result.get('round_medians_ns', [result['median_ns']])
+        result['baseline_median_ns'] = int(statistics.median(old_rounds))
+        result['ratio'] = statistics.median(new_rounds) / max(statistics.median(old_rounds), 1)
+        if min(new_rounds) > max(old_rounds) * (1 + threshold):
+            regressions.append(result)
+    return regressions
+
+
+def _parse_sizes(text: str) -> List[Tuple[int, int]]:
+    sizes = []
+    for size in text.split(','):
+        rows, _, cols = size.partition('x')
+        sizes.append((int(rows), int(cols)))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the engine hot paths.')
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--operations', default=','.join(OPERATIONS))
+    parser.add_argument('--sizes', default=','.join(f'{rows}x{cols}' for rows, cols in SIZES),
+                        help='comma-separated ROWSxCOLS')
+    parser.add_argument('--densities', default=','.join(str(d) for d in DENSITIES))
+    parser.add_argument('--budget', type=float, default=0.2, help='seconds of timed calls per case')
+    parser.add_argument('--repeats', type=int, default=5, help='rounds each case is timed in')
+    parser.add_argument('--max-seconds', type=float, default=30.0,
+                        help='skip cases expected to take longer than this per call')
+    parser.add_argument('--out', help='write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='slowdown that counts as a regression (0.10 = 10%%)')
+    args = parser.parse_args()
+
+    for name in args.engines.split(','):
+        if name not in ENGINES:
+            parser.error(f"unknown engine {name!r}")
+    for name in args.operations.split(','):
+        if name not in OPERATIONS:
+            parser.error(f"unknown operation {name!r}")
+
+    report = run_suite(args.engines.split(','), args.operations.split(','), _parse_sizes(args.sizes),
+                       [float(d) for d in args.densities.split(',')], args.budget, args.max_seconds,
+                       max(1, args.repeats))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        report['baseline'] = args.baseline
+        report['threshold'] = args.threshold
+        report['regressions'] = len(regressions)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        for result in regressions:
+            print(f"REGRESSION {_format_result(result)}  {result['ratio']:.2f}x baseline", file=sys.stderr)
+        print(f"{len(regressions)} regressions over {args.threshold:.0%}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Callable, List, Optional
 
 class DrMario:
     def __init__(self):
@@ -7,6 +7,8 @@ class DrMario:
         self.field: List[List[str]] = []
         self.faller: Optional[dict] = None
         self.is_game_over = False
+        # Called with (game, event) as each event happens
+        self.event_listener: Optional[Callable[['DrMario', dict], None]] = None
 
     def initialize(self, rows: int, cols: int):
         self.rows = rows
@@ -16,6 +18,10 @@ class DrMario:
     def set_empty_field(self):
         self.initialize(self.rows, self.cols)
 
+    def _emit(self, kind: str, **data):
+        if self.event_listener is not None:
+            self.event_listener(self, {'type': kind, **data})
+
     def set_field_contents(self, lines: List[str]):
         for r in range(self.rows):
             for c in range(self.cols):
@@ -112,6 +118,7 @@ class DrMario:
                 'state': 'landed'
             }
             self.is_game_over = True
+            self._emit('game_over')
             return
         
         self.faller = {
@@ -183,6 +190,7 @@ class DrMario:
         if not self.faller:
             matched = self.find_matches()
             if matched:
+                self._emit('cells_matched', cells=matched, cause='tick')
                 self.remove_matches(matched)
                 self.apply_gravity()
             return
@@ -217,12 +225,13 @@ class DrMario:
                 self.field[r - 1][c] = self.faller['left']
                 self.field[r][c] = self.faller['right']
             self.faller = None
+            self._emit('faller_frozen', row=r, col=c)
 
             # Check for matches immediately after freezing
             matched = self.find_matches()
             if matched:
-                # First display the matches
-                self.print_field()
+                # Renderers display the matches at this point
+                self._emit('cells_matched', cells=matched, cause='freeze')
                 # Then remove them and apply gravity
                 self.remove_matches(matched)
                 self.apply_gravity()
@@ -306,4 +315,10 @@ class DrMario:
                         self.field[r][c] = ' '
                         moved = True
                 if not moved:
-                    break 
\ No newline at end of file
+                    break 
+
+def print_freeze_matches(game: DrMario, event: dict):
+    # Event listener for a3.py: when a frozen faller completes a run, the
+    # board is shown with the matches before they are cleared.
+    if event['type'] == 'cells_matched' and event['cause'] == 'freeze':
+        game.print_field()
@@ -0,0 +1,72 @@
+# dr_mario_backends.py
+#
+# Engines by name, imported only when one is asked for, so a CLI pays for
+# the engine it runs (and NumPy only if that is the batch engine) and
+# nothing else.
+#
+#   list      dr_mario_logic.DrMario, the reference
+#   bitboard  dr_mario_bitboard.BitboardDrMario, match finding on int masks
+#   compact   dr_mario_compact.CompactDrMario, bytearray rows of cell codes
+#   numpy     dr_mario_batch.BatchDrMario, many boards stepped at once
+#
+# 'game' engines run one board through the a2.py protocol (step,
+# print_field, events).  The drop-in ones accept whatever the reference
+# does and can stand in for it anywhere a2.py's DrMario is used; compact
+# only takes the cell values ' RYBryb' and rejects the rest (the '-' of a
+# 'B--Y' row, 'F R G'), so it runs only when asked for by name.  The
+# 'batch' engine has its own interface.  The CLIs take --engine NAME,
+# falling back to $DR_MARIO_ENGINE (drop-in engines only) and then 'list'.
+
+import importlib
+import os
+from typing import Dict, List, Optional, Tuple
+
+ENV_VAR = 'DR_MARIO_ENGINE'
+DEFAULT_BACKEND = 'list'
+
+# name -> (module, class, kind, drop-in)
+_BACKENDS: Dict[str, Tuple[str, str, str, bool]] = {
+    'list': ('dr_mario_logic', 'DrMario', 'game', True),
+    'bitboard': ('dr_mario_bitboard', 'BitboardDrMario', 'game', True),
+    'compact': ('dr_mario_compact', 'CompactDrMario', 'game', False),
+    'numpy': ('dr_mario_batch', 'BatchDrMario', 'batch', False)
+}
+
+
+def register_backend(name: str, module: str, cls: str, kind: str = 'game', drop_in: bool = True):
+    # Adds an engine without importing it
+    _BACKENDS[name] = (module, cls, kind, drop_in)
+
+
+def backend_names(kind: Optional[str] = None, drop_in: bool = False) -> List[str]:
+    # Every engine of the kind, or only the drop-in ones
+    return [name for name, (_, _, backend_kind, backend_drop_in) in _BACKENDS.items()
+            if kind in (None, backend_kind) and (backend_drop_in or not drop_in)]
+
+
+def load_backend(name: str, kind: Optional[str] = 'game') -> type:
+    try:
+        module, cls, backend_kind, _ = _BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown engine {name!r}; choose from {', '.join(backend_names(kind))}") from None
+    if kind is not None and backend_kind != kind:
+        raise ValueError(f"{name} is a {backend_kind} engine; choose from {', '.join(backend_names(kind))}")
+    return getattr(importlib.import_module(module), cls)
+
+
+def selected_backend(args: List[str], default: str = DEFAULT_BACKEND) -> str:
+    # The name given by --engine NAME or --engine=NAME in args, else the
+    # environment's, else default.  The environment applies to every run,
+    # so it may only name a drop-in engine.
+    for i, arg in enumerate(args):
+        if arg == '--engine' and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith('--engine='):
+            return arg[len('--engine='):]
+    name = os.environ.get(ENV_VAR)
+    if not name:
+        return default
+    if name in _BACKENDS and not _BACKENDS[name][3]:
+        raise ValueError(f"${ENV_VAR}={name}: {name} is not a drop-in engine, so it can only be "
+                         f"chosen with --engine; ${ENV_VAR} takes {', '.join(backend_names('game', True))}")
+    return name
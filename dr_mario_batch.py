@@ -0,0 +1,322 @@
+import contextlib
+import io
+import random
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from dr_mario_logic import DrMario
+
+# uint8 cell codes; pills are 1-3 and viruses 4-6 so that
+# (code - 1) % 3 gives the color regardless of case.
+EMPTY = 0
+CELL_CODES = {' ': 0, 'R': 1, 'Y': 2, 'B': 3, 'r': 4, 'y': 5, 'b': 6}
+CODE_CELLS = ' RYBryb'
+
+
+def _is_pill(cells: np.ndarray) -> np.ndarray:
+    return (cells >= 1) & (cells <= 3)
+
+
+class BatchDrMario:
+    """N independent DrMario boards of the same size stepped together.
+
+    Boards live in one (N, rows, cols) uint8 array and every operation works
+    on all boards at once, optionally restricted to a boolean `boards` mask.
+    pass_time follows dr_mario_logic.DrMario.pass_time exactly, except that
+    nothing is printed; the cells cleared by the last tick are kept in
+    last_matches instead.  Only the cell values ' RYBryb' are supported.
+    """
+
+    def __init__(self, count: int, rows: int, cols: int):
+        self.count = count
+        self.rows = rows
+        self.cols = cols
+        self.field = np.zeros((count, rows, cols), dtype=np.uint8)
+
+        self.has_faller = np.zeros(count, dtype=bool)
+        self.faller_row = np.zeros(count, dtype=np.int64)
+        self.faller_col = np.zeros(count, dtype=np.int64)
+        self.faller_vertical = np.zeros(count, dtype=bool)
+        self.faller_landed = np.zeros(count, dtype=bool)
+        self.faller_left = np.zeros(count, dtype=np.uint8)
+        self.faller_right = np.zeros(count, dtype=np.uint8)
+
+        self.is_game_over = np.zeros(count, dtype=bool)
+        self.last_matches = np.zeros((count, rows, cols), dtype=bool)
+
+    @classmethod
+    def from_games(cls, games: List[DrMario]) -> 'BatchDrMario':
+        batch = cls(len(games), games[0].rows, games[0].cols)
+        for i, game in enumerate(games):
+            batch.load_game(i, game)
+        return batch
+
+    def load_game(self, i: int, game: DrMario):
+        for r in range(self.rows):
+            self.field[i, r] = [CELL_CODES[cell] for cell in game.field[r]]
+
+        self.is_game_over[i] = game.is_game_over
+        self.has_faller[i] = game.faller is not None
+        if game.faller:
+            self.faller_row[i] = game.faller['row']
+            self.faller_col[i] = game.faller['col']
+            self.faller_vertical[i] = game.faller['orientation'] == 'vertical'
+            self.faller_landed[i] = game.faller['state'] == 'landed'
+            self.faller_left[i] = CELL_CODES[game.faller['left']]
+            self.faller_right[i] = CELL_CODES[game.faller['right']]
+
+    def to_game(self, i: int) -> DrMario:
+        game = DrMario()
+        game.initialize(self.rows, self.cols)
+        game.set_field_contents([''.join(CODE_CELLS[code] for code in self.field[i, r])
+                                 for r in range(self.rows)])
+
+        game.is_game_over = bool(self.is_game_over[i])
+        if self.has_faller[i]:
+            game.faller = {
+                'row': int(self.faller_row[i]),
+                'col': int(self.faller_col[i]),
+                'orientation': 'vertical' if self.faller_vertical[i] else 'horizontal',
+                'left': CODE_CELLS[self.faller_left[i]],
+                'right': CODE_CELLS[self.faller_right[i]],
+                'state': 'landed' if self.faller_landed[i] else 'falling'
+            }
+        return game
+
+    def _boards(self, boards: Optional[np.ndarray]) -> np.ndarray:
+        if boards is None:
+            return np.ones(self.count, dtype=bool)
+        return boards
+
+    def contains_virus(self) -> np.ndarray:
+        return (self.field >= 4).any(axis=(1, 2))
+
+    def faller_mask(self) -> np.ndarray:
+        mask = np.zeros(self.field.shape, dtype=bool)
+        idx = np.nonzero(self.has_faller)[0]
+        r = self.faller_row[idx]
+        c = self.faller_col[idx]
+        vertical = self.faller_vertical[idx]
+
+        mask[idx, r, c] = True
+        h = ~vertical
+        mask[idx[h], r[h], c[h] + 1] = True
+        v = vertical & (r >= 1)
+        mask[idx[v], r[v] - 1, c[v]] = True
+        return mask
+
+    def find_matches(self) -> np.ndarray:
+        f = self.field
+        color = np.where(f == EMPTY, 0, (f.astype(np.int16) - 1) % 3 + 1)
+        color[self.faller_mask()] = 0
+        virus = f >= 4
+        matched = np.zeros(f.shape, dtype=bool)
+
+        if self.cols >= 4:
+            first = color[:, :, :-3]
+            run = (first != 0)
+            for k in (1, 2, 3):
+                run &= color[:, :, k:self.cols - 3 + k] == first
+            # A run that starts on a virus only counts if it is all viruses
+            all_virus = virus[:, :, :-3] & virus[:, :, 1:-2] & virus[:, :, 2:-1] & virus[:, :, 3:]
+            run &= ~virus[:, :, :-3] | all_virus
+            for k in range(4):
+                matched[:, :, k:self.cols - 3 + k] |= run
+
+        if self.rows >= 4:
+            first = color[:, :-3, :]
+            run = (first != 0)
+            for k in (1, 2, 3):
+                run &= color[:, k:self.rows - 3 + k, :] == first
+            for k in range(4):
+                matched[:, k:self.rows - 3 + k, :] |= run
+
+        return matched
+
+    def remove_matches(self, matched: np.ndarray):
+        self.field[matched] = EMPTY
+
+    def apply_gravity(self, boards: Optional[np.ndarray] = None) -> np.ndarray:
+        f = self.field
+        moved = np.zeros(self.count, dtype=bool)
+        active = self._boards(boards)
+
+        for c in range(self.cols):
+            # As in DrMario.apply_gravity, at most one move per column
+            done = ~active
+            for r in range(self.rows - 2, -1, -1):
+                if done.all():
+                    break
+                pill = _is_pill(f[:, r, c])
+                below_empty = f[:, r + 1, c] == EMPTY
+
+                if c + 1 < self.cols:
+                    pair = pill & _is_pill(f[:, r, c + 1])
+                    move_pair = ~done & pair & below_empty & (f[:, r + 1, c + 1] == EMPTY)
+                else:
+                    pair = np.zeros(self.count, dtype=bool)
+                    move_pair = pair
+
+                if c > 0:
+                    right_half = ~pair & pill & _is_pill(f[:, r, c - 1])
+                else:
+                    right_half = np.zeros(self.count, dtype=bool)
+                move_single = ~done & pill & ~pair & ~right_half & below_empty
+
+                if move_pair.any():
+                    f[move_pair, r + 1, c:c + 2] = f[move_pair, r, c:c + 2]
+                    f[move_pair, r, c:c + 2] = EMPTY
+                if move_single.any():
+                    f[move_single, r + 1, c] = f[move_single, r, c]
+                    f[move_single, r, c] = EMPTY
+
+                done = done | move_pair | move_single
+                moved |= move_pair | move_single
+
+        return moved
+
+    def spawn_faller(self, left: str, right: str, boards: Optional[np.ndarray] = None):
+        boards = self._boards(boards)
+        blocked = (self.field[:, 1, 1] != EMPTY) | (self.field[:, 1, 2] != EMPTY)
+
+        self.has_faller[boards] = True
+        self.faller_row[boards] = 1
+        self.faller_col[boards] = 1
+        self.faller_vertical[boards] = False
+        self.faller_left[boards] = CELL_CODES[left]
+        self.faller_right[boards] = CELL_CODES[right]
+        self.faller_landed[boards] = blocked[boards]
+        self.is_game_over |= boards & blocked
+
+    def _cells_empty(self, idx: np.ndarray, r: np.ndarray, c: np.ndarray) -> np.ndarray:
+        inside = (r >= 0) & (r < self.rows) & (c >= 0) & (c < self.cols)
+        result = np.zeros(len(idx), dtype=bool)
+        result[inside] = self.field[idx[inside], r[inside], c[inside]] == EMPTY
+        return result
+
+    def rotate_faller(self, clockwise: bool = True, boards: Optional[np.ndarray] = None):
+        idx = np.nonzero(self._boards(boards) & self.has_faller)[0]
+        r = self.faller_row[idx]
+        c = self.faller_col[idx]
+        vertical = self.faller_vertical[idx]
+
+        to_vertical = idx[~vertical & self._cells_empty(idx, r - 1, c)]
+        to_horizontal = idx[vertical & self._cells_empty(idx, r, c + 1)]
+
+        self.faller_vertical[to_vertical] = True
+        self.faller_vertical[to_horizontal] = False
+        if not clockwise:
+            left = self.faller_left[to_horizontal].copy()
+            self.faller_left[to_horizontal] = self.faller_right[to_horizontal]
+            self.faller_right[to_horizontal] = left
+
+    def move_faller(self, direction: int, boards: Optional[np.ndarray] = None):
+        idx = np.nonzero(self._boards(boards) & self.has_faller)[0]
+        r = self.faller_row[idx]
+        new_col = self.faller_col[idx] + direction
+        vertical = self.faller_vertical[idx]
+
+        second_r = np.where(vertical, r - 1, r)
+        second_c = np.where(vertical, new_col, new_col + 1)
+        ok = self._cells_empty(idx, r, new_col) & self._cells_empty(idx, second_r, second_c)
+        self.faller_col[idx[ok]] = new_col[ok]
+
+    def pass_time(self, boards: Optional[np.ndarray] = None):
+        boards = self._boards(boards)
+        settle = boards & ~self.has_faller
+
+        idx = np.nonzero(boards & self.has_faller)[0]
+        r = self.faller_row[idx]
+        c = self.faller_col[idx]
+        vertical = self.faller_vertical[idx]
+        landed = self.faller_landed[idx]
+
+        can_fall = self._cells_empty(idx, r + 1, c) & \
+            (vertical | self._cells_empty(idx, r + 1, c + 1))
+
+        falling = ~landed
+        self.faller_row[idx[falling & can_fall]] += 1
+        self.faller_landed[idx[falling & ~can_fall]] = True
+
+        # Freeze the fallers that had already landed before this tick
+        frozen = idx[landed]
+        fr = r[landed]
+        fc = c[landed]
+        fv = vertical[landed]
+        self.field[frozen, np.where(fv, fr - 1, fr), fc] = self.faller_left[frozen]
+        self.field[frozen, fr, np.where(fv, fc, fc + 1)] = self.faller_right[frozen]
+        self.has_faller[frozen] = False
+        settle[frozen] = True
+
+        matched = self.find_matches() & settle[:, None, None]
+        self.last_matches = matched
+        self.remove_matches(matched)
+        self.apply_gravity(settle)
+
+
+def _random_game(rnd: random.Random, rows: int, cols: int) -> DrMario:
+    game = DrMario()
+    game.initialize(rows, cols)
+    game.set_field_contents([' ' * cols if r < 2 else
+                             ''.join(rnd.choice('RYBryb') if rnd.random() < 0.4 else ' '
+                                     for _ in range(cols))
+                             for r in range(rows)])
+    return game
+
+
+def check_against_scalar(count: int = 200, rows: int = 12, cols: int = 8,
+                         steps: int = 300, seed: int = 0) -> bool:
+    rnd = random.Random(seed)
+    games = [_random_game(rnd, rows, cols) for _ in range(count)]
+    batch = BatchDrMario.from_games(games)
+
+    for step in range(steps):
+        action = np.array([rnd.randrange(6) for _ in range(count)])
+        left, right = rnd.choice('RYB'), rnd.choice('RYB')
+        clockwise = rnd.random() < 0.5
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, game in enumerate(games):
+                if action[i] == 0:
+                    if not game.faller:
+                        game.spawn_faller(left, right)
+                elif action[i] == 1:
+                    game.move_faller(-1)
+                elif action[i] == 2:
+                    game.move_faller(1)
+                elif action[i] == 3:
+                    game.rotate_faller(clockwise)
+                else:
+                    game.pass_time()
+
+        spawn = (action == 0) & ~batch.has_faller
+        batch.spawn_faller(left, right, spawn)
+        batch.move_faller(-1, action == 1)
+        batch.move_faller(1, action == 2)
+        batch.rotate_faller(clockwise, action == 3)
+        batch.pass_time(action >= 4)
+
+        for i, game in enumerate(games):
+            other = batch.to_game(i)
+            if other.field != game.field or other.faller != game.faller or \
+               other.is_game_over != game.is_game_over:
+                print(f'Board {i} diverged at step {step}')
+                return False
+    return True
+
+
+if __name__ == '__main__':
+    if check_against_scalar():
+        print('Batch engine matches DrMario.pass_time')
+    else:
+        sys.exit(1)
+
+    batch = BatchDrMario.from_games([_random_game(random.Random(i), 12, 8) for i in range(10000)])
+    start = time.perf_counter()
+    for _ in range(100):
+        batch.pass_time()
+    elapsed = time.perf_counter() - start
+    print(f'{batch.count * 100 / elapsed:,.0f} board ticks/sec')
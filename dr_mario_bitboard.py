@@ -0,0 +1,168 @@
+from typing import Dict, List, Set, Tuple
+
+from dr_mario_logic import DrMario
+
+
+class BitboardDrMario(DrMario):
+    """DrMario whose match detection runs on integer bitmasks.
+
+    Cell (r, c) is bit r * cols + c.  One mask is kept per cell value plus a
+    virus mask (lowercase cells) and a pill mask (uppercase cells), all
+    updated in _set_cell, so find_matches is a handful of AND/shift
+    operations per color instead of a walk over every cell.  The list-based
+    field is still kept up to date, so everything that reads game.field
+    (a2.py included) works unchanged.  The list engine's run caches are
+    rebuilt from the masks only when something reads them (snapshot).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.color_masks: Dict[str, int] = {}
+        self.virus_mask = 0
+        self.pill_mask = 0
+        self._row_starts = 0
+        self._bulk_write = False  # Masks are rebuilt afterwards, not per cell
+        self._runs_stale = False  # _h_runs and _v_runs miss cleared _dirty cells
+
+    def initialize(self, rows: int, cols: int):
+        super().initialize(rows, cols)
+        self._runs_stale = False
+        self._rebuild_masks()
+
+    def restore(self, blob):
+        super().restore(blob)
+        self._runs_stale = False
+        self._rebuild_masks()
+
+    def set_field_contents(self, lines: List[str]):
+        # Each write to a mask copies the whole board, so the masks are
+        # built once from the finished field instead
+        self._bulk_write = True
+        try:
+            self._write_field_contents(lines)
+        finally:
+            self._bulk_write = False
+            self._rebuild_masks()
+        self._emit('field_set')
+
+    def _rebuild_masks(self):
+        # One mask per value, read off the field as a binary string so the
+        # cost is linear in the number of cells
+        rows = self.rows
+        cols = self.cols
+        cells = [value for row in reversed(self.field) for value in reversed(row)]
+        text = ''.join(cells)
+        values = set(cells) - {' '}
+        self.color_masks = {}
+        for value in values:
+            if len(text) == len(cells):
+                bits = text.translate({ord(other): '1' if other == value else '0' for other in values | {' '}})
+            else:
+                bits = ''.join(['1' if cell == value else '0' for cell in cells])
+            self.color_masks[value] = int(bits, 2)
+        self.virus_mask = 0
+        self.pill_mask = 0
+        for value, mask in self.color_masks.items():
+            if value.islower():
+                self.virus_mask |= mask
+            elif value.isupper():
+                self.pill_mask |= mask
+
+        # Bits where a horizontal run of four may start (c <= cols - 4)
+        if cols >= 4 and rows > 0:
+            every_row = ((1 << (rows * cols)) - 1) // ((1 << cols) - 1)
+            self._row_starts = ((1 << (cols - 3)) - 1) * every_row
+        else:
+            self._row_starts = 0
+
+    def _set_cell(self, r: int, c: int, value: str):
+        old = self.field[r][c]
+        if old == value or self._bulk_write:
+            super()._set_cell(r, c, value)
+            return
+
+        bit = 1 << ((r % self.rows) * self.cols + c)
+        if old != ' ':
+            self.color_masks[old] &= ~bit
+            if not self.color_masks[old]:
+                del self.color_masks[old]
+        if value != ' ':
+            self.color_masks[value] = self.color_masks.get(value, 0) | bit
+
+        if value.islower():
+            self.virus_mask |= bit
+        else:
+            self.virus_mask &= ~bit
+        if value.isupper():
+            self.pill_mask |= bit
+        else:
+            self.pill_mask &= ~bit
+
+        super()._set_cell(r, c, value)
+
+    def _faller_mask(self) -> int:
+        mask = 0
+        for r, c in self.get_faller_cells():
+            if 0 <= r < self.rows and 0 <= c < self.cols:
+                mask |= 1 << (r * self.cols + c)
+        return mask
+
+    def _color_groups(self) -> List[int]:
+        # find_matches compares cells case-insensitively, so 'R' and 'r'
+        # belong to the same run.
+        groups: Dict[str, int] = {}
+        for value, mask in self.color_masks.items():
+            key = value.upper()
+            groups[key] = groups.get(key, 0) | mask
+        return list(groups.values())
+
+    def _run_starts(self, free: int = -1) -> Tuple[int, int]:
+        # Start bits of the horizontal and vertical runs of four made of
+        # the cells in free
+        cols = self.cols
+        h_starts = 0
+        v_starts = 0
+
+        for group in self._color_groups():
+            g = group & free
+
+            h = g & (g >> 1) & (g >> 2) & (g >> 3) & self._row_starts
+            if h:
+                # A run that starts on a virus only counts if it is all viruses
+                v = g & self.virus_mask
+                all_virus = v & (v >> 1) & (v >> 2) & (v >> 3)
+                h_starts |= h & (~v | all_virus)
+
+            v_starts |= g & (g >> cols) & (g >> (2 * cols)) & (g >> (3 * cols))
+
+        return h_starts, v_starts
+
+    def find_matches_mask(self) -> int:
+        # The window cache of the list engine is not used here; it is
+        # marked stale rather than rescanned cell by cell
+        if self._dirty:
+            self._dirty.clear()
+            self._runs_stale = True
+        cols = self.cols
+        h, v = self._run_starts(~self._faller_mask())
+        return (h | (h << 1) | (h << 2) | (h << 3) |
+                v | (v << cols) | (v << (2 * cols)) | (v << (3 * cols)))
+
+    def _rescan_dirty(self):
+        if self._dirty or self._runs_stale:
+            h, v = self._run_starts()
+            self._h_runs = self.mask_to_cells(h)
+            self._v_runs = self.mask_to_cells(v)
+            self._dirty.clear()
+            self._runs_stale = False
+
+    def find_matches(self) -> Set[Tuple[int, int]]:
+        return self.mask_to_cells(self.find_matches_mask())
+
+    def mask_to_cells(self, mask: int) -> Set[Tuple[int, int]]:
+        cells = set()
+        while mask:
+            low = mask & -mask
+            cells.add(divmod(low.bit_length() - 1, self.cols))
+            mask ^= low
+        return cells
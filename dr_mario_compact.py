@@ -0,0 +1,603 @@
+import enum
+import random
+import struct
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from dr_mario_logic import DrMario, is_direct_input, parse_line_content, write_frame
+
+# Cells are small ints: the low two bits are the color, plus a flag saying
+# whether the cell is a virus (lowercase) or a pill half (uppercase).
+EMPTY = 0
+RED = 1
+YELLOW = 2
+BLUE = 3
+COLOR_MASK = 3
+VIRUS = 4
+PILL = 8
+
+CELL_CODES = {
+    ' ': EMPTY,
+    'R': PILL | RED, 'Y': PILL | YELLOW, 'B': PILL | BLUE,
+    'r': VIRUS | RED, 'y': VIRUS | YELLOW, 'b': VIRUS | BLUE
+}
+CELL_TEXT = {code: text for text, code in CELL_CODES.items()}
+
+R_PILL = PILL | RED
+Y_PILL = PILL | YELLOW
+
+# Glyphs indexed by cell code
+_CELL_GLYPHS = {code: f' {text} ' for code, text in CELL_TEXT.items()}
+_MATCHED_GLYPHS = {code: f'*{text}*' for code, text in CELL_TEXT.items()}
+
+
+# Maps a cell code to its bare color (0 for empty), for bytes.translate
+_COLOR_TABLE = bytes(code & COLOR_MASK for code in range(256))
+_RUNS = [bytes([color]) * 4 for color in (RED, YELLOW, BLUE)]
+
+
+# snapshot() layout: this header followed by the rows of cell codes
+_SNAPSHOT_HEADER = struct.Struct('<2sBHHBBBiiI')
+_SNAPSHOT_MAGIC = b'DC'
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_GAME_OVER = 1
+_SNAPSHOT_FALLER = 2
+_SNAPSHOT_VERTICAL = 4
+_SNAPSHOT_LANDED = 8
+
+
+def encode_cell(text: str) -> int:
+    try:
+        return CELL_CODES[text]
+    except KeyError:
+        raise ValueError(f"Unsupported cell: {text!r}") from None
+
+
+class Orientation(enum.IntEnum):
+    HORIZONTAL = 0
+    VERTICAL = 1
+
+
+class FallerState(enum.IntEnum):
+    FALLING = 0
+    LANDED = 1
+
+
+class Faller:
+    __slots__ = ('row', 'col', 'orientation', 'state', 'left', 'right')
+
+    def __init__(self, row: int, col: int, left: int, right: int, state: FallerState):
+        self.row = row
+        self.col = col
+        self.orientation = Orientation.HORIZONTAL
+        self.state = state
+        self.left = left
+        self.right = right
+
+    def as_dict(self) -> dict:
+        # The faller as dr_mario_logic.DrMario represents it
+        return {
+            'row': self.row,
+            'col': self.col,
+            'orientation': 'vertical' if self.orientation == Orientation.VERTICAL else 'horizontal',
+            'left': CELL_TEXT[self.left],
+            'right': CELL_TEXT[self.right],
+            'state': 'landed' if self.state == FallerState.LANDED else 'falling'
+        }
+
+
+class CompactDrMario:
+    """DrMario on integer-coded cells.
+
+    Each row is a bytearray of cell codes and the faller is a slotted
+    Faller, so the hot loops compare small ints instead of calling
+    .upper() and .islower() on strings.  Text only appears at the edges:
+    set_field_contents, spawn_faller, insert_virus and step take the same
+    strings as dr_mario_logic.DrMario, and print_field renders the same
+    frames.  Only the cell values ' RYBryb' are supported; anything else
+    (the '-' of a 'B--Y' row, 'F R G') raises ValueError, so this is not
+    a drop-in replacement and $DR_MARIO_ENGINE cannot select it.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.cols = 0
+        self.field: List[bytearray] = []
+        self.faller: Optional[Faller] = None
+        self.is_game_over = False
+        self.ticks_since_spawn = 0
+        self.event_listener: Optional[Callable[['CompactDrMario', dict], None]] = None
+        self._events: Optional[List[dict]] = None
+        self._virus_counts = [0, 0, 0, 0]  # Indexed by color
+        self._version = 0  # Bumped on every field write
+        self._runs_cache = (-1, None)
+
+    def initialize(self, rows: int, cols: int):
+        self.rows = rows
+        self.cols = cols
+        self.field = [bytearray(cols) for _ in range(rows)]
+        self._virus_counts = [0, 0, 0, 0]
+        self._version += 1
+        self._footer = ' ' + '-' * (cols * 3) + ' '
+
+    def set_empty_field(self):
+        self.initialize(self.rows, self.cols)
+        self._emit('field_reset')
+
+    def _emit(self, kind: str, **data):
+        if self._events is None and self.event_listener is None:
+            return
+        event = {'type': kind, **data}
+        if self._events is not None:
+            self._events.append(event)
+        if self.event_listener is not None:
+            self.event_listener(self, event)
+
+    def _set_cell(self, r: int, c: int, code: int):
+        row = self.field[r]
+        old = row[c]
+        if old & VIRUS:
+            self._virus_counts[old & COLOR_MASK] -= 1
+        if code & VIRUS:
+            self._virus_counts[code & COLOR_MASK] += 1
+        row[c] = code
+        self._version += 1
+
+    def set_field_contents(self, lines: List[str]):
+        for r in range(self.rows):
+            c = 0
+            while c < self.cols:
+                if c + 2 < self.cols and lines[r][c:c+3] == 'R--' and lines[r][c+3] == 'Y':
+                    self._set_cell(r, c, R_PILL)
+                    self._set_cell(r, c + 3, Y_PILL)
+                    c += 4
+                else:
+                    self._set_cell(r, c, encode_cell(lines[r][c]))
+                    c += 1
+        self._emit('field_set')
+
+    def field_lines(self) -> List[str]:
+        return [''.join(CELL_TEXT[code] for code in row) for row in self.field]
+
+    def contains_virus(self) -> bool:
+        return any(self._virus_counts)
+
+    def virus_counts(self) -> Dict[str, int]:
+        return {'r': self._virus_counts[RED], 'y': self._virus_counts[YELLOW],
+                'b': self._virus_counts[BLUE]}
+
+    def get_faller_cells(self) -> Dict[tuple, tuple]:
+        faller = self.faller
+        if not faller:
+            return {}
+        r = faller.row
+        c = faller.col
+        if faller.orientation == Orientation.HORIZONTAL:
+            return {(r, c): (faller.left, faller.state), (r, c + 1): (faller.right, faller.state)}
+        return {(r - 1, c): (faller.left, faller.state), (r, c): (faller.right, faller.state)}
+
+    def print_field(self):
+        faller_cells = self.get_faller_cells()
+        matched_cells = self.find_matches()
+        vertical = self.faller is not None and self.faller.orientation == Orientation.VERTICAL
+
+        lines = []
+        for r in range(min(4, self.rows)):
+            row = self.field[r]
+            parts = ['|']
+            skip_next = False
+            for c in range(self.cols):
+                if skip_next:
+                    skip_next = False
+                    continue
+
+                cell = row[c]
+                next_cell = row[c+1] if c+1 < self.cols else EMPTY
+
+                if (r, c) in faller_cells:
+                    code, state = faller_cells[(r, c)]
+                    char = CELL_TEXT[code]
+                    if not vertical and (r, c + 1) in faller_cells:
+                        right_char = CELL_TEXT[faller_cells[(r, c + 1)][0]]
+                        if state == FallerState.FALLING:
+                            parts.append(f'[{char}--{right_char}]')
+                        else:
+                            parts.append(f'|{char}--{right_char}|')
+                        skip_next = True
+                    elif vertical:
+                        parts.append(f'[{char}]' if state == FallerState.FALLING else f'|{char}|')
+                    else:
+                        parts.append(_CELL_GLYPHS[code])
+                elif cell == R_PILL and next_cell == Y_PILL:
+                    parts.append('*R*-Y ' if (r, c) in matched_cells else ' R--Y ')
+                    skip_next = True
+                elif (r, c) in matched_cells:
+                    parts.append(_MATCHED_GLYPHS[cell])
+                else:
+                    parts.append(_CELL_GLYPHS[cell])
+            parts.append('|')
+            lines.append(''.join(parts))
+
+        lines.append(self._footer)
+        if self.is_game_over:
+            lines.append('GAME OVER')
+        elif not self.contains_virus():
+            lines.append('LEVEL CLEARED')
+
+        if self.rows < 4:
+            write_frame(lines[:self.rows])
+            raise IndexError('list index out of range')
+        write_frame(lines)
+
+    def spawn_faller(self, left: str, right: str):
+        left_code = encode_cell(left)
+        right_code = encode_cell(right)
+        mid = 1
+
+        if self.field[1][mid] or self.field[1][mid + 1]:
+            self.faller = Faller(1, mid, left_code, right_code, FallerState.LANDED)
+            self.is_game_over = True
+            self.ticks_since_spawn = 0
+            self._emit('game_over')
+            return
+
+        self.faller = Faller(1, mid, left_code, right_code, FallerState.FALLING)
+        self.ticks_since_spawn = 0
+        self._emit('faller_spawned', row=1, col=mid, left=left, right=right)
+
+    def rotate_faller(self, clockwise=True):
+        faller = self.faller
+        if not faller:
+            return
+
+        r = faller.row
+        c = faller.col
+
+        if faller.orientation == Orientation.HORIZONTAL:
+            if r-1 >= 0 and not self.field[r-1][c]:
+                faller.orientation = Orientation.VERTICAL
+                self._emit('faller_rotated', orientation='vertical')
+        else:
+            if c + 1 < self.cols and not self.field[r][c+1]:
+                faller.orientation = Orientation.HORIZONTAL
+                if not clockwise:
+                    faller.left, faller.right = faller.right, faller.left
+                self._emit('faller_rotated', orientation='horizontal')
+
+    def move_faller(self, direction: int):
+        faller = self.faller
+        if not faller:
+            return
+
+        new_col = faller.col + direction
+        r = faller.row
+
+        if faller.orientation == Orientation.HORIZONTAL:
+            if 0 <= new_col and new_col + 1 < self.cols and \
+               not self.field[r][new_col] and not self.field[r][new_col + 1]:
+                faller.col = new_col
+                self._emit('faller_moved', row=r, col=new_col)
+        else:
+            if 0 <= new_col < self.cols and \
+               not self.field[r][new_col] and not self.field[r - 1][new_col]:
+                faller.col = new_col
+                self._emit('faller_moved', row=r, col=new_col)
+
+    def insert_virus(self, row: int, col: int, color: str):
+        if 0 <= row < self.rows and 0 <= col < self.cols:
+            self._set_cell(row, col, encode_cell(color.lower()))
+            self._emit('virus_inserted', row=row, col=col, color=color.lower())
+
+    def _can_fall(self, r: int, c: int, orientation: Orientation) -> bool:
+        # Whether a faller whose bottom is at row r could move down a row
+        if r + 1 >= self.rows:
+            return False
+        below = self.field[r + 1]
+        if orientation == Orientation.HORIZONTAL:
+            return not below[c] and not below[c + 1]
+        return not below[c]
+
+    def landing_row(self) -> Optional[int]:
+        faller = self.faller
+        if not faller:
+            return None
+        if faller.orientation == Orientation.HORIZONTAL and faller.col + 1 >= self.cols:
+            # A faller hanging off a board under three columns wide; fails
+            # as dr_mario_logic.DrMario does
+            raise IndexError('list index out of range')
+        row = faller.row
+        while self._can_fall(row, faller.col, faller.orientation):
+            row += 1
+        return row
+
+    def hard_drop(self):
+        if not self.faller:
+            return
+        row = self.landing_row()
+        if row != self.faller.row:
+            self.faller.row = row
+            self._emit('faller_moved', row=row, col=self.faller.col)
+        self.faller.state = FallerState.LANDED
+        self._emit('faller_landed', row=row, col=self.faller.col)
+
+    def pass_time(self):
+        faller = self.faller
+        if not faller:
+            matched = self.find_matches()
+            if matched:
+                self._emit('cells_matched', cells=matched, cause='tick')
+                self.remove_matches(matched)
+            self.apply_gravity()
+            return
+
+        r = faller.row
+        c = faller.col
+
+        if faller.state == FallerState.FALLING:
+            if self._can_fall(r, c, faller.orientation):
+                faller.row += 1
+                self._emit('faller_moved', row=r + 1, col=c)
+            else:
+                faller.state = FallerState.LANDED
+                self._emit('faller_landed', row=r, col=c)
+            return
+
+        if faller.orientation == Orientation.HORIZONTAL and c + 1 >= self.cols:
+            # dr_mario_logic.DrMario looks below both halves before freezing,
+            # which fails, before any write, for a faller hanging off the board
+            self._can_fall(r, c, faller.orientation)
+
+        if faller.orientation == Orientation.HORIZONTAL:
+            self._set_cell(r, c, faller.left)
+            self._set_cell(r, c + 1, faller.right)
+        else:
+            self._set_cell(r - 1, c, faller.left)
+            self._set_cell(r, c, faller.right)
+        self.faller = None
+        self._emit('faller_frozen', row=r, col=c)
+
+        matched = self.find_matches()
+        if matched:
+            self._emit('cells_matched', cells=matched, cause='freeze')
+            self.remove_matches(matched)
+        self.apply_gravity()
+
+    def tick(self):
+        self.ticks_since_spawn += 1
+        self.pass_time()
+        if self.ticks_since_spawn == 2 and self.faller and self.faller.state == FallerState.FALLING:
+            self.faller.state = FallerState.LANDED
+            self._emit('faller_landed', row=self.faller.row, col=self.faller.col)
+
+    def find_matches(self) -> set:
+        faller_cells = self.get_faller_cells()
+        h_runs, v_runs = self._find_runs()
+        matched = set()
+
+        for r, c in h_runs:
+            if not faller_cells or not any((r, col) in faller_cells for col in (c, c + 1, c + 2, c + 3)):
+                matched.update(((r, c), (r, c + 1), (r, c + 2), (r, c + 3)))
+        for r, c in v_runs:
+            if not faller_cells or not any((row, c) in faller_cells for row in (r, r + 1, r + 2, r + 3)):
+                matched.update(((r, c), (r + 1, c), (r + 2, c), (r + 3, c)))
+        return matched
+
+    def _find_runs(self) -> tuple:
+        # Start cells of every horizontal and vertical run of four, ignoring
+        # the faller; reused until the field changes.  Rows and columns are
+        # reduced to bytes of bare colors so runs are found with bytes.find
+        # rather than cell by cell.
+        version, runs = self._runs_cache
+        if version == self._version:
+            return runs
+
+        h_runs = []
+        v_runs = []
+        field = self.field
+        colors = [row.translate(_COLOR_TABLE) for row in field]
+
+        for r, line in enumerate(colors):
+            row = field[r]
+            for run in _RUNS:
+                c = line.find(run)
+                while c != -1:
+                    # A run that starts on a virus only counts if it is all viruses
+                    if not (row[c] & VIRUS) or row[c + 1] & row[c + 2] & row[c + 3] & VIRUS:
+                        h_runs.append((r, c))
+                    c = line.find(run, c + 1)
+
+        if self.rows >= 4:
+            for c, line in enumerate(map(bytes, zip(*colors))):
+                for run in _RUNS:
+                    r = line.find(run)
+                    while r != -1:
+                        v_runs.append((r, c))
+                        r = line.find(run, r + 1)
+
+        runs = (h_runs, v_runs)
+        self._runs_cache = (self._version, runs)
+        return runs
+
+    def remove_matches(self, matched):
+        had_viruses = self.contains_virus()
+        for r, c in matched:
+            self._set_cell(r, c, EMPTY)
+        if had_viruses and not self.contains_virus():
+            self._emit('level_cleared')
+
+    def apply_gravity(self) -> bool:
+        field = self.field
+        cols = self.cols
+        fell = []
+        for c in range(cols):
+            for r in range(self.rows - 2, -1, -1):
+                row = field[r]
+                cell = row[c]
+                # Only pill halves fall
+                if not cell & PILL:
+                    continue
+
+                below = field[r + 1]
+                if c + 1 < cols and row[c + 1] & PILL:
+                    if not below[c] and not below[c + 1]:
+                        below[c] = cell
+                        below[c + 1] = row[c + 1]
+                        row[c] = row[c + 1] = EMPTY
+                        fell.extend([(r, c), (r, c + 1)])
+                        break
+                elif c > 0 and row[c - 1] & PILL:
+                    # The left half moves this one
+                    continue
+                elif not below[c]:
+                    below[c] = cell
+                    row[c] = EMPTY
+                    fell.append((r, c))
+                    break
+
+        if fell:
+            self._version += 1
+            self._emit('cells_fell', cells=fell)
+        return bool(fell)
+
+    def apply_direct_input(self, command: str):
+        content = parse_line_content(command, self.cols)
+        target_row = 1
+        if any(any(row) for row in self.field):
+            target_row = 3
+        if target_row >= self.rows:
+            raise IndexError('list index out of range')
+
+        codes = [encode_cell(ch) for ch in content]
+        for c, code in enumerate(codes):
+            if code:
+                self._set_cell(target_row, c, code)
+        self._emit('field_set')
+
+    def step(self, command: str, lines: Optional[List[str]] = None) -> List[dict]:
+        # Same protocol as dr_mario_logic.DrMario.step
+        self._events = []
+        try:
+            if command == '':
+                self.tick()
+            elif command == 'EMPTY':
+                self.set_empty_field()
+            elif command == 'CONTENTS':
+                self.set_field_contents(lines)
+            elif command.startswith('F '):
+                parts = command.split()
+                if len(parts) != 3:
+                    raise ValueError("F command requires two colors (e.g., 'F R Y')")
+                self.spawn_faller(parts[1], parts[2])
+            elif command == 'A':
+                self.rotate_faller(clockwise=True)
+            elif command == 'B':
+                self.rotate_faller(clockwise=False)
+            elif command in ['<', '>']:
+                self.move_faller(-1 if command == '<' else 1)
+            elif command == 'instant drop':
+                self.hard_drop()
+            elif command.startswith('V '):
+                parts = command.split()
+                if len(parts) != 4:
+                    raise ValueError("V command requires row, col, and color (e.g., 'V 3 4 R')")
+                self.insert_virus(int(parts[1]), int(parts[2]), parts[3])
+            elif is_direct_input(command):
+                self.apply_direct_input(command)
+            else:
+                raise ValueError(f"Unknown command: {command}")
+            return self._events
+        finally:
+            self._events = None
+
+    def snapshot(self) -> bytes:
+        # The game state as an immutable blob for restore(); the cells are
+        # copied out as they are stored.
+        flags = 0
+        if self.is_game_over:
+            flags |= _SNAPSHOT_GAME_OVER
+        faller = self.faller or Faller(0, 0, EMPTY, EMPTY, FallerState.FALLING)
+        if self.faller:
+            flags |= _SNAPSHOT_FALLER
+            if faller.orientation == Orientation.VERTICAL:
+                flags |= _SNAPSHOT_VERTICAL
+            if faller.state == FallerState.LANDED:
+                flags |= _SNAPSHOT_LANDED
+        header = _SNAPSHOT_HEADER.pack(
+            _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, self.rows, self.cols, flags,
+            faller.left, faller.right, faller.row, faller.col, self.ticks_since_spawn)
+        return b''.join((header, *self.field))
+
+    def restore(self, blob):
+        # Accepts anything snapshot() returned, or a buffer holding one
+        view = memoryview(blob)
+        (magic, version, rows, cols, flags, left, right,
+         faller_row, faller_col, ticks) = _SNAPSHOT_HEADER.unpack_from(view)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+            raise ValueError('Not a CompactDrMario snapshot')
+
+        offset = _SNAPSHOT_HEADER.size
+        cells = view[offset:offset + rows * cols]
+        self.rows = rows
+        self.cols = cols
+        self.field = [bytearray(cells[start:start + cols]) for start in range(0, rows * cols, cols)]
+        self.is_game_over = bool(flags & _SNAPSHOT_GAME_OVER)
+        self.ticks_since_spawn = ticks
+        if flags & _SNAPSHOT_FALLER:
+            state = FallerState.LANDED if flags & _SNAPSHOT_LANDED else FallerState.FALLING
+            self.faller = Faller(faller_row, faller_col, left, right, state)
+            if flags & _SNAPSHOT_VERTICAL:
+                self.faller.orientation = Orientation.VERTICAL
+        else:
+            self.faller = None
+
+        data = bytes(cells)
+        self._virus_counts = [0] + [data.count(VIRUS | color) for color in (RED, YELLOW, BLUE)]
+        self._version += 1
+        self._footer = ' ' + '-' * (cols * 3) + ' '
+
+
+def _benchmark_board(rnd: random.Random, rows: int, cols: int) -> List[str]:
+    return [' ' * cols if r < 2 else
+            ''.join(rnd.choice('RYBryb') if rnd.random() < 0.5 else ' ' for _ in range(cols))
+            for r in range(rows)]
+
+
+def benchmark(rows: int = 16, cols: int = 8, boards: int = 200, ticks: int = 50, seed: int = 0):
+    # Times the same scripted ticks on both engines and checks that they
+    # end on the same fields.
+    rnd = random.Random(seed)
+    layouts = [_benchmark_board(rnd, rows, cols) for _ in range(boards)]
+    results = {}
+    for engine in (DrMario, CompactDrMario):
+        games = []
+        for lines in layouts:
+            game = engine()
+            game.initialize(rows, cols)
+            game.set_field_contents(lines)
+            games.append(game)
+
+        start = time.perf_counter()
+        for game in games:
+            for i in range(ticks):
+                if i % 10 == 0 and not game.faller and not game.is_game_over:
+                    game.spawn_faller('R', 'Y')
+                game.pass_time()
+        elapsed = time.perf_counter() - start
+        results[engine.__name__] = (elapsed, [game.field_lines() for game in games])
+
+    list_time, list_fields = results['DrMario']
+    compact_time, compact_fields = results['CompactDrMario']
+    total = boards * ticks
+    print(f'{rows}x{cols}, {total} ticks')
+    print(f'  DrMario         {list_time / total * 1e6:8.2f} us/tick')
+    print(f'  CompactDrMario  {compact_time / total * 1e6:8.2f} us/tick  ({list_time / compact_time:.2f}x)')
+    print(f'  fields match: {list_fields == compact_fields}')
+    return list_fields == compact_fields
+
+
+if __name__ == '__main__':
+    ok = True
+    for rows, cols in ((4, 4), (16, 8), (64, 32)):
+        ok = benchmark(rows, cols) and ok
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,327 @@
+# dr_mario_fuzz.py
+#
+# Differential fuzzer for the engines.  Random command scripts are run
+# through every backend the way its CLI runs them (a2.run_batch for the
+# game engines of dr_mario_backends, a3.main for dr_mario) and the printed
+# output and final state are compared with the first backend's.  The first
+# script that diverges is shrunk to a minimal reproducer: commands are
+# dropped, the board is made smaller and CONTENTS cells are blanked for as
+# long as the backends still disagree.
+#
+#   python dr_mario_fuzz.py [--backends list,bitboard] [--plain-cells]
+#                           [--cases N | --seconds S] [--workers N] [--seed S]
+#                           [--out FILE]
+#
+# Scripts use whatever the reference accepts, 'B--Y' rows and colors other
+# than R, Y and B included.  Engines that are not drop-in replacements,
+# like compact, only take ' RYBryb' and need --plain-cells.
+#
+# Script i of a seed is always the same, so a run can be repeated with any
+# number of workers.  --out writes the reproducer as a script that
+# `python a2.py --batch FILE` (or a3.py on stdin) runs as is.
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import List, Optional, Tuple
+
+import a2
+from dr_mario_backends import backend_names, load_backend
+
+# a3.py's engine, which only a3.main can drive
+A3_BACKEND = 'dr_mario'
+
+# A case is (rows, cols, commands); each command is a tuple of the lines it
+# takes, which is one line except for CONTENTS and its rows
+Case = Tuple[int, int, List[Tuple[str, ...]]]
+
+_COMMAND_WEIGHTS = (
+    ('tick', 30), ('<', 8), ('>', 8), ('A', 8), ('B', 8), ('F', 12), ('V', 5),
+    ('CONTENTS', 4), ('EMPTY', 2), ('direct', 3), ('instant drop', 2), ('Q', 1)
+)
+_COMMANDS = [command for command, _ in _COMMAND_WEIGHTS]
+_WEIGHTS = [weight for _, weight in _COMMAND_WEIGHTS]
+
+PLAIN_CELLS = ' RYBryb'
+# Also the '-' of a 'B--Y' pill, other colors and cells that are neither a
+# pill half nor a virus, all of which the reference takes
+ANY_CELLS = ' RYBryb-#Xx0Gg'
+
+
+def _contents_line(rnd: random.Random, cols: int, cells: str, colors: str, density: float) -> str:
+    line = ''.join(rnd.choice(cells[1:]) if rnd.random() < density else ' ' for _ in range(cols))
+    if '-' in cells and cols >= 4 and rnd.random() < 0.3:
+        c = rnd.randint(0, cols - 4)
+        line = f'{line[:c]}{rnd.choice(colors)}--{rnd.choice(colors)}{line[c + 4:]}'
+    return line
+
+
+def random_case(rnd: random.Random, max_rows: int = 10, max_cols: int = 8, max_commands: int = 60,
+                cells: str = ANY_CELLS) -> Case:
+    rows = rnd.randint(1, max_rows)
+    cols = rnd.randint(1, max_cols)
+    colors = ''.join(cell for cell in cells if cell.isupper())
+    commands = []
+    for kind in rnd.choices(_COMMANDS, _WEIGHTS, k=rnd.randint(1, max_commands)):
+        if kind == 'tick':
+            commands.append(('',))
+        elif kind == 'F':
+            commands.append((f'F {rnd.choice(colors)} {rnd.choice(colors)}',))
+        elif kind == 'V':
+            commands.append((f'V {rnd.randint(-1, rows)} {rnd.randint(-1, cols)} '
+                             f'{rnd.choice(colors + colors.lower())}',))
+        elif kind == 'CONTENTS':
+            density = rnd.random()
+            commands.append(('CONTENTS', *(_contents_line(rnd, cols, cells, colors, density)
+                                           for _ in range(rows))))
+        elif kind == 'direct':
+            commands.append((''.join(rnd.choice('RYBryb ') for _ in range(rnd.randint(1, cols))),))
+        else:
+            commands.append((kind,))
+        if kind == 'Q':
+            break
+    return rows, cols, commands
+
+
+def case_random(seed: int, index: int) -> random.Random:
+    return random.Random(f'{seed}:{index}')
+
+
+def script_lines(case: Case) -> List[str]:
+    rows, cols, commands = case
+    return [str(rows), str(cols)] + [line for command in commands for line in command]
+
+
+def run_backend(name: str, lines: List[str]) -> Tuple[str, Optional[tuple]]:
+    # The output of the backend's CLI for the script, and the final
+    # (field, faller, game over) where the CLI hands the game back
+    out = io.StringIO()
+    if name == A3_BACKEND:
+        import a3
+        stdin = sys.stdin
+        sys.stdin = io.StringIO(''.join(line + '\n' for line in lines))
+        try:
+            with contextlib.redirect_stdout(out):
+                a3.main()
+        finally:
+            sys.stdin = stdin
+        return out.getvalue(), None
+
+    with contextlib.redirect_stdout(out):
+        game = a2.run_batch(lines, load_backend(name))
+    if game is None:
+        return out.getvalue(), None
+    faller = game.faller
+    if faller is not None and not isinstance(faller, dict):
+        faller = faller.as_dict()
+    return out.getvalue(), (game.field_lines(), faller, game.is_game_over)
+
+
+def divergence(case: Case, backends: List[str]) -> Optional[str]:
+    # How the first backend that disagrees with backends[0] differs, or None
+    lines = script_lines(case)
+    reference, *others = backends
+    expected_output, expected_state = run_backend(reference, lines)
+    for name in others:
+        output, state = run_backend(name, lines)
+        if output != expected_output:
+            expected = expected_output.split('\n')
+            actual = output.split('\n')
+            line = next((i for i, (a, b) in enumerate(zip(expected, actual)) if a != b),
+                        min(len(expected), len(actual)))
+            return (f"{name} output differs from {reference} at line {line + 1}:\n"
+                    f"  {reference}: {expected[line] if line < len(expected) else '<end of output>'!r}\n"
+                    f"  {name}: {actual[line] if line < len(actual) else '<end of output>'!r}")
+        if state is not None and expected_state is not None and state != expected_state:
+            return (f"{name} final state differs from {reference}:\n"
+                    f"  {reference}: {expected_state!r}\n"
+                    f"  {name}: {state!r}")
+    return None
+
+
+def fuzz_chunk(backends: List[str], seed: int, start: int, count: int, max_rows: int, max_cols: int,
+               max_commands: int, cells: str) -> Tuple[int, List[int]]:
+    # Runs cases start..start+count; returns the commands run and the
+    # indexes of the cases that diverged
+    commands = 0
+    failures = []
+    for index in range(start, start + count):
+        case = random_case(case_random(seed, index), max_rows, max_cols, max_commands, cells)
+        commands += len(case[2])
+        if divergence(case, backends) is not None:
+            failures.append(index)
+    return commands, failures
+
+
+def shrink(case: Case, backends: List[str]) -> Case:
+    # Smallest case found that still diverges, trying one change at a time
+    def fails(candidate: Case) -> bool:
+        return divergence(candidate, backends) is not None
+
+    rows, cols, commands = case
+    progress = True
+    while progress:
+        progress = False
+
+        # Drop runs of commands, halving the run length down to one
+        chunk = max(1, len(commands) // 2)
+        while chunk >= 1:
+            i = 0
+            while i < len(commands):
+                candidate = commands[:i] + commands[i + chunk:]
+                if fails((rows, cols, candidate)):
+                    commands = candidate
+                    progress = True
+                else:
+                    i += chunk
+            chunk //= 2
+
+        # Smaller boards: drop the top row or the last column of CONTENTS
+        if rows > 1:
+            candidate = [command[:1] + command[2:] if command[0] == 'CONTENTS' else command
+                         for command in commands]
+            if fails((rows - 1, cols, candidate)):
+                rows, commands, progress = rows - 1, candidate, True
+        if cols > 1:
+            candidate = [(command[0], *(line[:cols - 1] for line in command[1:]))
+                         if command[0] == 'CONTENTS' else command for command in commands]
+            if fails((rows, cols - 1, candidate)):
+                cols, commands, progress = cols - 1, candidate, True
+
+        # Blank CONTENTS cells one at a time
+        for i, command in enumerate(commands):
+            if command[0] != 'CONTENTS':
+                continue
+            for r in range(1, len(command)):
+                for c, cell in enumerate(command[r]):
+                    if cell == ' ':
+                        continue
+                    line = command[r][:c] + ' ' + command[r][c + 1:]
+                    candidate_command = command[:r] + (line,) + command[r + 1:]
+                    candidate = commands[:i] + [candidate_command] + commands[i + 1:]
+                    if fails((rows, cols, candidate)):
+                        commands, command, progress = candidate, candidate_command, True
+    return rows, cols, commands
+
+
+def fuzz(backends: List[str], cases: Optional[int] = None, seconds: Optional[float] = None,
+         workers: int = 1, seed: int = 0, max_rows: int = 10, max_cols: int = 8,
+         max_commands: int = 60, cells: str = ANY_CELLS, chunk: int = 200) -> dict:
+    # Runs cases in chunks until `cases` have run, `seconds` have passed or
+    # one diverges, then shrinks the earliest divergent case
+    start_time = time.perf_counter()
+    commands = 0
+    ran = 0
+    failures: List[int] = []
+    next_start = 0
+
+    def more() -> bool:
+        if failures:
+            return False
+        if cases is not None:
+            return next_start < cases
+        return time.perf_counter() - start_time < (seconds if seconds is not None else 10.0)
+
+    def submit(executor) -> tuple:
+        nonlocal next_start
+        count = chunk if cases is None else min(chunk, cases - next_start)
+        args = (backends, seed, next_start, count, max_rows, max_cols, max_commands, cells)
+        next_start += count
+        return (executor.submit(fuzz_chunk, *args) if executor else fuzz_chunk(*args)), count
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            while more() and len(pending) < workers * 2:
+                future, count = submit(pool)
+                pending[future] = count
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk_commands, chunk_failures = future.result()
+                    commands += chunk_commands
+                    ran += pending.pop(future)
+                    failures.extend(chunk_failures)
+                    if more():
+                        future, count = submit(pool)
+                        pending[future] = count
+    else:
+        while more():
+            (chunk_commands, chunk_failures), count = submit(None)
+            commands += chunk_commands
+            ran += count
+            failures.extend(chunk_failures)
+    elapsed = time.perf_counter() - start_time
+
+    report = {
+        'backends': backends,
+        'seed': seed,
+        'cases': ran,
+        'commands': commands,
+        'seconds': elapsed,
+        'commands_per_minute': commands / elapsed * 60 if elapsed > 0 else 0.0,
+        'failures': len(failures)
+    }
+    if failures:
+        index = min(failures)
+        case = random_case(case_random(seed, index), max_rows, max_cols, max_commands, cells)
+        minimal = shrink(case, backends)
+        report.update({'case': index, 'script': script_lines(minimal),
+                       'divergence': divergence(minimal, backends)})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fuzz the engines against each other.')
+    parser.add_argument('--backends', default=','.join(backend_names('game', drop_in=True)),
+                        help=f"comma-separated, the first is the reference "
+                             f"({', '.join(backend_names('game') + [A3_BACKEND])})")
+    parser.add_argument('--cases', type=int, help='run this many cases (default: for --seconds)')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-rows', type=int, default=10)
+    parser.add_argument('--max-cols', type=int, default=8)
+    parser.add_argument('--max-commands', type=int, default=60)
+    parser.add_argument('--plain-cells', action='store_true',
+                        help="only use the cell values ' RYBryb', for engines that take nothing else")
+    parser.add_argument('--out', help='write the minimal diverging script here')
+    args = parser.parse_args()
+
+    backends = args.backends.split(',')
+    for name in backends:
+        if name not in backend_names('game') + [A3_BACKEND]:
+            parser.error(f"unknown backend {name!r}")
+        if name in backend_names('game') and name not in backend_names('game', drop_in=True) \
+                and not args.plain_cells:
+            parser.error(f"{name} only takes the cell values {PLAIN_CELLS!r}; add --plain-cells")
+    if len(backends) < 2:
+        parser.error('need at least two backends to compare')
+
+    cells = PLAIN_CELLS if args.plain_cells else ANY_CELLS
+    report = fuzz(backends, args.cases, args.seconds, args.workers, args.seed,
+                  args.max_rows, args.max_cols, args.max_commands, cells)
+
+    print(f"{report['cases']} cases, {report['commands']} commands in {report['seconds']:.2f}s "
+          f"({report['commands_per_minute']:,.0f} commands/min, {args.workers} workers)", file=sys.stderr)
+    if not report['failures']:
+        print(f"no divergence between {', '.join(backends)}", file=sys.stderr)
+        return
+
+    print(f"case {report['case']} diverged; minimal script ({len(report['script'])} lines):")
+    for line in report['script']:
+        print(f"  {line!r}")
+    print(report['divergence'])
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(''.join(line + '\n' for line in report['script']))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+# dr_mario_levels.py
+#
+# Seeded virus layouts.  generate_level places K viruses on a rows x cols
+# board without ever forming a run of four: per-color bitboards track the
+# viruses, and each color keeps a mask of the cells where it would
+# complete a run, updated from precomputed window masks as viruses go in.
+# The same seed and index always give the same level.
+#
+#   python dr_mario_levels.py ROWS COLS VIRUSES [--seed S]
+#   python dr_mario_levels.py ROWS COLS VIRUSES --count N --out FILE [--workers N]
+#
+# The first form prints one level as CONTENTS lines.  The second writes N
+# distinct levels to a binary file: a header, then each level packed two
+# bits per cell (0 empty, 1 r, 2 y, 3 b), row by row from the low bits.
+
+import argparse
+import hashlib
+import os
+import random
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+from dr_mario_logic import DrMario
+
+_FILE_HEADER = struct.Struct('<4sBHHHQ')
+_FILE_MAGIC = b'DMLV'
+_FILE_VERSION = 1
+
+# (rows, cols) -> for each cell, the masks of the windows of four that hold it
+_WINDOWS: Dict[Tuple[int, int], List[Tuple[int, ...]]] = {}
+
+
+def _windows(rows: int, cols: int) -> List[Tuple[int, ...]]:
+    windows = _WINDOWS.get((rows, cols))
+    if windows is not None:
+        return windows
+
+    by_cell = [[] for _ in range(rows * cols)]
+    for r in range(rows):
+        for c in range(cols):
+            cells = []
+            if c + 3 < cols:
+                cells.append([r * cols + c + i for i in range(4)])
+            if r + 3 < rows:
+                cells.append([(r + i) * cols + c for i in range(4)])
+            for window in cells:
+                mask = sum(1 << p for p in window)
+                for p in window:
+                    by_cell[p].append(mask)
+    windows = [tuple(masks) for masks in by_cell]
+    _WINDOWS[rows, cols] = windows
+    return windows
+
+
+def generate_packed(rows: int, cols: int, viruses: int, rnd: random.Random, min_row: int = 3) -> int:
+    # The level as an int holding two bits per cell (see the file format).
+    # Viruses go in rows min_row and below.
+    region = (rows - min_row) * cols
+    if viruses > region or min_row < 0:
+        raise ValueError(f"{viruses} viruses do not fit below row {min_row} of a {rows}x{cols} board")
+
+    windows = _windows(rows, cols)
+    color_masks = [0, 0, 0]
+    forbidden = [0, 0, 0]  # Cells where each color would complete a run
+    occupied = 0
+    packed = 0
+    free = list(range(min_row * cols, rows * cols))
+    placed = 0
+
+    while placed < viruses:
+        if not free:
+            raise ValueError(f"Could not place {viruses} viruses without a run of four")
+        # One draw picks the cell (integer part) and the first color tried
+        # (fractional part); randrange twice per virus costs more than the
+        # rest of the loop
+        x = rnd.random() * len(free)
+        index = int(x)
+        first = int((x - index) * 3)
+        p = free[index]
+        free[index] = free[-1]
+        free.pop()
+
+        bit = 1 << p
+        for color in (first, (first + 1) % 3, (first + 2) % 3):
+            if not forbidden[color] & bit:
+                break
+        else:
+            # Every color would complete a run here, now and from then on
+            continue
+
+        color_masks[color] |= bit
+        occupied |= bit
+        packed |= (color + 1) << (2 * p)
+        placed += 1
+
+        mask = color_masks[color]
+        for window in windows[p]:
+            if (mask & window).bit_count() == 3:
+                missing = window & ~mask
+                if not missing & occupied:
+                    forbidden[color] |= missing
+
+    return packed
+
+
+def unpack_level(packed: int, rows: int, cols: int) -> List[str]:
+    # CONTENTS lines for a packed level
+    cells = []
+    for _ in range(rows * cols):
+        cells.append(' ryb'[packed & 3])
+        packed >>= 2
+    return [''.join(cells[r * cols:(r + 1) * cols]) for r in range(rows)]
+
+
+def generate_level(rows: int, cols: int, viruses: int, seed: int = 0, index: int = 0,
+                   min_row: int = 3) -> List[str]:
+    return unpack_level(generate_packed(rows, cols, viruses, level_random(seed, index), min_row), rows, cols)
+
+
+def level_random(seed: int, index: int) -> random.Random:
+    # Level `index` of a seed gets its own stream, so any slice of a bulk
+    # run can be regenerated on its own
+    return random.Random(f'{seed}:{index}')
+
+
+def generate_chunk(rows: int, cols: int, viruses: int, seed: int, start: int, count: int,
+                   min_row: int = 3) -> bytes:
+    size = _record_size(rows, cols)
+    return b''.join(
+        generate_packed(rows, cols, viruses, level_random(seed, index), min_row).to_bytes(size, 'little')
+        for index in range(start, start + count))
+
+
+def _record_size(rows: int, cols: int) -> int:
+    return (rows * cols + 3) // 4
+
+
+def write_levels(path: str, rows: int, cols: int, viruses: int, count: int, seed: int = 0,
+                 min_row: int = 3, workers: int = 1, chunk: int = 20000) -> dict:
+    # Writes `count` distinct levels.  Duplicates (likely only on small
+    # boards) are dropped and more indexes are drawn until there are
+    # enough; the file is the same for any number of workers.
+    size = _record_size(rows, cols)
+    start_time = time.perf_counter()
+    seen = set()
+    written = 0
+    generated = 0
+
+    with open(path, 'wb') as f:
+        f.write(_FILE_HEADER.pack(_FILE_MAGIC, _FILE_VERSION, rows, cols, viruses, 0))
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            next_index = 0
+            while written < count:
+                # Duplicates send this round again for the rest
+                wanted = count - written
+                starts = list(range(next_index, next_index + wanted, chunk))
+                counts = [min(chunk, next_index + wanted - start) for start in starts]
+                next_index += wanted
+                args = ([rows] * len(starts), [cols] * len(starts), [viruses] * len(starts),
+                        [seed] * len(starts), starts, counts, [min_row] * len(starts))
+                results = pool.map(generate_chunk, *args) if pool else map(generate_chunk, *args)
+
+                for data in results:
+                    for offset in range(0, len(data), size):
+                        record = data[offset:offset + size]
+                        generated += 1
+                        key = hashlib.blake2b(record, digest_size=8).digest()
+                        if key in seen or written == count:
+                            continue
+                        seen.add(key)
+                        f.write(record)
+                        written += 1
+                if generated > 100 * count + 1000:
+                    raise ValueError(f"Only {written} distinct levels found for a {rows}x{cols} board "
+                                     f"with {viruses} viruses")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        f.seek(0)
+        f.write(_FILE_HEADER.pack(_FILE_MAGIC, _FILE_VERSION, rows, cols, viruses, written))
+
+    elapsed = time.perf_counter() - start_time
+    return {'levels': written, 'generated': generated, 'seconds': elapsed,
+            'levels_per_second': written / elapsed if elapsed > 0 else 0.0}
+
+
+def read_levels(path: str) -> Iterator[List[str]]:
+    with open(path, 'rb') as f:
+        magic, version, rows, cols, _, count = _FILE_HEADER.unpack(f.read(_FILE_HEADER.size))
+        if magic != _FILE_MAGIC or version != _FILE_VERSION:
+            raise ValueError(f"{path} is not a level file")
+        size = _record_size(rows, cols)
+        for _ in range(count):
+            yield unpack_level(int.from_bytes(f.read(size), 'little'), rows, cols)
+
+
+def check_levels(levels: int = 2000, seed: int = 0) -> int:
+    # Loads generated levels into DrMario and counts those with a match
+    rnd = random.Random(seed)
+    failures = 0
+    for index in range(levels):
+        rows = rnd.randint(5, 20)
+        cols = rnd.randint(3, 12)
+        min_row = rnd.randint(0, 3)
+        viruses = rnd.randint(0, (rows - min_row) * cols * 2 // 3)
+        try:
+            lines = generate_level(rows, cols, viruses, seed, index, min_row)
+        except ValueError:
+            continue
+        game = DrMario()
+        game.initialize(rows, cols)
+        game.set_field_contents(lines)
+        if game.find_matches() or sum(game.virus_counts().values()) != viruses:
+            failures += 1
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate seeded virus layouts.')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('cols', type=int)
+    parser.add_argument('viruses', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-row', type=int, default=3, help='highest row viruses may go in')
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--out', help='write --count levels to this binary file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--check', action='store_true', help='check random levels against find_matches')
+    args = parser.parse_args()
+
+    if args.check:
+        print(f"levels with a match: {check_levels(seed=args.seed)}")
+        return
+    if not args.out:
+        for index in range(args.count):
+            if index:
+                print()
+            for line in generate_level(args.rows, args.cols, args.viruses, args.seed, index, args.min_row):
+                print(line)
+        return
+
+    stats = write_levels(args.out, args.rows, args.cols, args.viruses, args.count, args.seed,
+                         args.min_row, args.workers)
+    print(f"{stats['levels']} levels in {stats['seconds']:.2f}s "
+          f"({stats['levels_per_second']:.0f} levels/s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
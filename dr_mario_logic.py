@@ -1,4 +1,76 @@
-from typing import List, Optional
+import hashlib
+import random
+import re
+import struct
+import sys
+from typing import Callable, Dict, List, Optional
+
+# Cell values that count as viruses; `cell in 'ryb'` is also true for the
+# substrings, which the original full-board check accepted.
+VIRUS_VALUES = ('r', 'y', 'b', 'ry', 'yb', 'ryb')
+
+class _GlyphTable(dict):
+    # Formats a glyph the first time a cell value is seen and reuses it after
+    def __init__(self, fmt: str):
+        super().__init__()
+        self.fmt = fmt
+
+    def __missing__(self, key):
+        glyph = self.fmt.format(*key) if isinstance(key, tuple) else self.fmt.format(key)
+        self[key] = glyph
+        return glyph
+
+
+class _ZobristKeys(dict):
+    # A 64-bit key per (value, row, col) and per faller placement, derived
+    # from the key itself so that every process hashes states the same way
+    def __missing__(self, key):
+        digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        self[key] = value
+        return value
+
+
+_ZOBRIST_KEYS = _ZobristKeys()
+_CELL_GLYPHS = _GlyphTable(' {} ')
+_MATCHED_GLYPHS = _GlyphTable('*{}*')
+_FROZEN_PAIR_GLYPHS = _GlyphTable(' {}--{} ')
+_FALLER_GLYPHS = {'falling': _GlyphTable('[{}]'), 'landed': _GlyphTable('|{}|')}
+_FALLER_PAIR_GLYPHS = {'falling': _GlyphTable('[{}--{}]'), 'landed': _GlyphTable('|{}--{}|')}
+
+
+# snapshot() layout: this header (which ends with the field's Zobrist
+# hash), then the cells row by row, the column tops, and the faller's left
+# and right values.  Cells take one ASCII byte each when they all fit;
+# otherwise each gets a slot of cell_size bytes holding a length byte and
+# its UTF-8 text.  The runs of four are found again from the cells on
+# restore, so a blob never carries another engine's stale run caches.
+_SNAPSHOT_HEADER = struct.Struct('<2sBBHHBiiIHHQ')
+_SNAPSHOT_MAGIC = b'DM'
+_SNAPSHOT_VERSION = 3
+_SNAPSHOT_GAME_OVER = 1
+_SNAPSHOT_DIRECT_INPUT = 2
+_SNAPSHOT_FALLER = 4
+_SNAPSHOT_VERTICAL = 8
+_SNAPSHOT_LANDED = 16
+
+# Start of four cells that are the same ignoring case, found in rows (or
+# columns) joined by newlines; the lookahead finds overlapping runs
+_RUN_OF_FOUR = re.compile(r'(?=([^ \n])\1\1\1)', re.IGNORECASE)
+
+
+def write_frame(lines: List[str]):
+    # One write per frame; text already printed is flushed first so that
+    # output written with print() stays in order.
+    text = '\n'.join(lines) + '\n'
+    out = sys.stdout
+    buffer = getattr(out, 'buffer', None)
+    if buffer is None:
+        out.write(text)
+    else:
+        out.flush()
+        buffer.write(text.encode(out.encoding, out.errors))
+
 
 class DrMario:
     def __init__(self):
@@ -8,85 +80,248 @@ class DrMario:
         self.faller: Optional[dict] = None
         self.is_game_over = False
         self.direct_input_mode = False  # Flag to track which mode we're in
+        self._dirty = set()  # Cells written since the last find_matches
+        self._h_runs = set()  # Start cells of horizontal runs of four
+        self._v_runs = set()  # Start cells of vertical runs of four
+        self._virus_counts: Dict[str, int] = {'r': 0, 'y': 0, 'b': 0}
+        self._virus_total = 0
+        self._row_versions: List[int] = []  # Bumped whenever a row changes
+        self._row_cache: Dict[int, tuple] = {}
+        self._footer = ' '
+        self._column_tops: List[int] = []
+        self._field_hash = 0  # XOR of the Zobrist keys of the non-empty cells
+        self.ticks_since_spawn = 0
+        # Called with (game, event) as each event happens, while the game is
+        # still in the state the event describes
+        self.event_listener: Optional[Callable[['DrMario', dict], None]] = None
+        self._events: Optional[List[dict]] = None  # Collected during step()
 
     def initialize(self, rows: int, cols: int):
         self.rows = rows
         self.cols = cols
         self.field = [[' ' for _ in range(cols)] for _ in range(rows)]
+        self._dirty = set()
+        self._h_runs = set()
+        self._v_runs = set()
+        self._virus_counts = {'r': 0, 'y': 0, 'b': 0}
+        self._virus_total = 0
+        self._row_versions = [0] * rows
+        self._row_cache = {}
+        self._footer = ' ' + '-' * (cols * 3) + ' '
+        self._column_tops = [rows] * cols  # Topmost occupied row, rows if empty
+        self._field_hash = 0
 
     def set_empty_field(self):
         self.initialize(self.rows, self.cols)
+        self._emit('field_reset')
+
+    def _emit(self, kind: str, **data):
+        if self._events is None and self.event_listener is None:
+            return
+        event = {'type': kind, **data}
+        if self._events is not None:
+            self._events.append(event)
+        if self.event_listener is not None:
+            self.event_listener(self, event)
+
+    def step(self, command: str, lines: Optional[List[str]] = None) -> List[dict]:
+        # Runs one command of the a2.py protocol without printing anything
+        # and returns the events it produced.  CONTENTS takes its rows in
+        # `lines`; Q is left to the caller.
+        self._events = []
+        try:
+            if command == '':
+                self.tick()
+            elif command == 'EMPTY':
+                self.set_empty_field()
+            elif command == 'CONTENTS':
+                self.set_field_contents(lines)
+            elif command.startswith('F '):
+                parts = command.split()
+                if len(parts) != 3:
+                    raise ValueError("F command requires two colors (e.g., 'F R Y')")
+                self.spawn_faller(parts[1], parts[2])
+            elif command == 'A':
+                self.rotate_faller(clockwise=True)
+            elif command == 'B':
+                self.rotate_faller(clockwise=False)
+            elif command in ['<', '>']:
+                self.move_faller(-1 if command == '<' else 1)
+            elif command == 'instant drop':
+                self.hard_drop()
+            elif command.startswith('V '):
+                parts = command.split()
+                if len(parts) != 4:
+                    raise ValueError("V command requires row, col, and color (e.g., 'V 3 4 R')")
+                self.insert_virus(int(parts[1]), int(parts[2]), parts[3])
+            elif is_direct_input(command):
+                self.apply_direct_input(command)
+            else:
+                raise ValueError(f"Unknown command: {command}")
+            return self._events
+        finally:
+            self._events = None
+
+    def tick(self):
+        # A time step as the CLI takes it: the faller is forced to land on
+        # the second tick after it spawned.
+        self.ticks_since_spawn += 1
+        self.pass_time()
+        if self.ticks_since_spawn == 2 and self.faller and self.faller['state'] == 'falling':
+            self.faller['state'] = 'landed'
+            self._emit('faller_landed', row=self.faller['row'], col=self.faller['col'])
+
+    def apply_direct_input(self, command: str):
+        rows = self.rows
+        cols = self.cols
+        content = parse_line_content(command, cols)
+        current_field = [[''] * cols for _ in range(rows)]
+
+        for r in range(rows):
+            for c in range(cols):
+                if self.field[r][c] != ' ':
+                    current_field[r][c] = self.field[r][c]
+
+        # Goes in row 1 on an empty field, row 3 otherwise
+        target_row = 1
+
+        for r in range(rows):
+            if any(self.field[r][c] != ' ' for c in range(cols)):
+                target_row = 3
+                break
+
+        for c in range(cols):
+            if content[c] != ' ':
+                current_field[target_row][c] = content[c]
+
+        lines = []
+        for r in range(rows):
+            line = ''
+            for c in range(cols):
+                line += current_field[r][c] if current_field[r][c] != '' else ' '
+            lines.append(line)
+
+        self.set_field_contents(lines)
 
     def set_field_contents(self, lines: List[str]):
+        self._write_field_contents(lines)
+        self._emit('field_set')
+
+    def _write_field_contents(self, lines: List[str]):
         for r in range(self.rows):
             c = 0
             while c < self.cols:
                 if c + 2 < self.cols and lines[r][c:c+3] == 'R--' and lines[r][c+3] == 'Y':
-                    self.field[r][c] = 'R'
-                    self.field[r][c+3] = 'Y'
+                    self._set_cell(r, c, 'R')
+                    self._set_cell(r, c + 3, 'Y')
                     c += 4
                 else:
-                    self.field[r][c] = lines[r][c]
+                    self._set_cell(r, c, lines[r][c])
                     c += 1
 
+    def _set_cell(self, r: int, c: int, value: str):
+        # Every write to the field goes through here so that alternate
+        # backends can keep their own indexes in sync with it.
+        r %= self.rows
+        old = self.field[r][c]
+        self.field[r][c] = value
+        if old == value:
+            return
+
+        self._dirty.add((r, c))
+        self._row_versions[r] += 1
+        if old != ' ':
+            self._field_hash ^= _ZOBRIST_KEYS[old, r, c]
+        if value != ' ':
+            self._field_hash ^= _ZOBRIST_KEYS[value, r, c]
+        if old in VIRUS_VALUES:
+            self._virus_counts[old] -= 1
+            self._virus_total -= 1
+        if value in VIRUS_VALUES:
+            self._virus_counts[value] = self._virus_counts.get(value, 0) + 1
+            self._virus_total += 1
+
+        if value != ' ':
+            if r < self._column_tops[c]:
+                self._column_tops[c] = r
+        elif r == self._column_tops[c]:
+            top = r + 1
+            while top < self.rows and self.field[top][c] == ' ':
+                top += 1
+            self._column_tops[c] = top
+
     def print_field(self):
         faller_cells = self.get_faller_cells()
         matched_cells = self.find_matches()
-        
+
+        matched_by_row = {}
+        for r, c in matched_cells:
+            matched_by_row.setdefault(r, set()).add(c)
+
         # Always show at least 4 rows
-        for r in range(4):
-            line = '|'
-            skip_next = False
-            for c in range(self.cols):
-                if skip_next:
-                    skip_next = False
-                    continue
-                
-                cell = self.field[r][c]
-                next_cell = self.field[r][c+1] if c+1 < self.cols else ' '
-                
-                if (r, c) in faller_cells:
-                    char, state = faller_cells[(r, c)]
-                    if self.faller['orientation'] == 'horizontal' and (r, c + 1) in faller_cells:
-                        right_char, _ = faller_cells[(r, c + 1)]
-                        if state == 'falling':
-                            line += f'[{char}--{right_char}]'
-                        elif state == 'landed':
-                            line += f'|{char}--{right_char}|'
-                        else:  # frozen
-                            line += f' {char}--{right_char} '
+        lines = []
+        for r in range(min(4, self.rows)):
+            faller_key = tuple(sorted((c, cell) for (fr, c), cell in faller_cells.items() if fr == r))
+            if faller_key:
+                faller_key += (self.faller['orientation'],)
+            matched_cols = matched_by_row.get(r, set())
+
+            key = (self._row_versions[r], faller_key, frozenset(matched_cols))
+            cached = self._row_cache.get(r)
+            if cached is None or cached[0] != key:
+                cached = (key, self._render_row(r, faller_cells, matched_cols))
+                self._row_cache[r] = cached
+            lines.append(cached[1])
+
+        lines.append(self._footer)
+        if self.is_game_over:
+            lines.append('GAME OVER')
+        elif not self.contains_virus():
+            lines.append('LEVEL CLEARED')
+
+        if self.rows < 4:
+            # The rows that exist are shown before the missing one fails
+            write_frame(lines[:self.rows])
+            raise IndexError('list index out of range')
+        write_frame(lines)
+
+    def _render_row(self, r: int, faller_cells: dict, matched_cols: set) -> str:
+        parts = ['|']
+        row = self.field[r]
+        skip_next = False
+        for c in range(self.cols):
+            if skip_next:
+                skip_next = False
+                continue
+
+            cell = row[c]
+            next_cell = row[c+1] if c+1 < self.cols else ' '
+
+            if (r, c) in faller_cells:
+                char, state = faller_cells[(r, c)]
+                if self.faller['orientation'] == 'horizontal' and (r, c + 1) in faller_cells:
+                    right_char, _ = faller_cells[(r, c + 1)]
+                    parts.append(_FALLER_PAIR_GLYPHS.get(state, _FROZEN_PAIR_GLYPHS)[char, right_char])
+                    skip_next = True
+                elif self.faller['orientation'] == 'vertical':
+                    parts.append(_FALLER_GLYPHS.get(state, _CELL_GLYPHS)[char])
+                else:
+                    parts.append(_CELL_GLYPHS[char])
+            else:
+                if c in matched_cols:
+                    if cell == 'R' and next_cell == 'Y':
+                        parts.append('*R*-Y ')
                         skip_next = True
-                    elif self.faller['orientation'] == 'vertical':
-                        if state == 'falling':
-                            line += f'[{char}]'
-                        elif state == 'landed':
-                            line += f'|{char}|'
-                        else:  # frozen
-                            line += f' {char} '
                     else:
-                        line += f' {char} '
+                        parts.append(_MATCHED_GLYPHS[cell])
                 else:
-                    if (r, c) in matched_cells:
-                        if cell == 'R' and next_cell == 'Y':
-                            line += f'*{cell}*-{next_cell} '
-                            skip_next = True
-                        else:
-                            line += f'*{cell}*'
+                    if cell == 'R' and next_cell == 'Y':
+                        parts.append(' R--Y ')
+                        skip_next = True
                     else:
-                        if cell == 'R' and next_cell == 'Y':
-                            line += f' {cell}--{next_cell} '
-                            skip_next = True
-                        else:
-                            line += f' {cell} '
-            line += '|'
-            print(line)
-
-        print(' ' + '-' * (self.cols * 3) + ' ')
-        has_viruses = self.contains_virus()
-        if self.is_game_over:
-            print('GAME OVER')
-        elif not has_viruses:
-            print('LEVEL CLEARED')
+                        parts.append(_CELL_GLYPHS[cell])
+        parts.append('|')
+        return ''.join(parts)
 
     def render_cell(self, cell: str) -> str:
         if cell in 'ryb':
@@ -96,7 +331,10 @@ class DrMario:
         return '   '
 
     def contains_virus(self) -> bool:
-        return any(cell in 'ryb' for row in self.field for cell in row)
+        return self._virus_total > 0
+
+    def virus_counts(self) -> Dict[str, int]:
+        return dict(self._virus_counts)
 
     def spawn_faller(self, left: str, right: str):
         mid = 1
@@ -111,6 +349,8 @@ class DrMario:
                 'state': 'landed'
             }
             self.is_game_over = True
+            self.ticks_since_spawn = 0
+            self._emit('game_over')
             return
         
         self.faller = {
@@ -122,6 +362,8 @@ class DrMario:
             'state': 'falling'
         }
         self.direct_input_mode = False  # Switch to faller mode
+        self.ticks_since_spawn = 0
+        self._emit('faller_spawned', row=1, col=mid, left=left, right=right)
 
     def rotate_faller(self, clockwise=True):
         if not self.faller:
@@ -135,6 +377,7 @@ class DrMario:
                 self.faller['orientation'] = 'vertical'
                 if clockwise:
                     pass
+                self._emit('faller_rotated', orientation='vertical')
         else:
             if c + 1 < self.cols and self.field[r][c+1] == ' ':
                 self.faller['orientation'] = 'horizontal'
@@ -142,6 +385,7 @@ class DrMario:
                     temp = self.faller['left']
                     self.faller['left'] = self.faller['right']
                     self.faller['right'] = temp
+                self._emit('faller_rotated', orientation='horizontal')
 
     def move_faller(self, direction: int):
         if not self.faller:
@@ -154,21 +398,61 @@ class DrMario:
             if 0 <= new_col and new_col + 1 < self.cols and \
                self.field[r][new_col] == ' ' and self.field[r][new_col + 1] == ' ':
                 self.faller['col'] = new_col
+                self._emit('faller_moved', row=r, col=new_col)
         elif self.faller['orientation'] == 'vertical':
             if 0 <= new_col < self.cols and \
                self.field[r][new_col] == ' ' and self.field[r - 1][new_col] == ' ':
                 self.faller['col'] = new_col
+                self._emit('faller_moved', row=r, col=new_col)
+
+    def column_top(self, c: int) -> int:
+        return self._column_tops[c]
+
+    def _floor_below(self, r: int, c: int) -> int:
+        # Lowest row the cell at (r, c) can fall to without passing through
+        # anything; O(1) unless something sits above row r in this column.
+        top = self._column_tops[c]
+        if top > r:
+            return top - 1
+        below = r + 1
+        while below < self.rows and self.field[below][c] == ' ':
+            below += 1
+        return below - 1
+
+    def landing_row(self) -> Optional[int]:
+        # Row the faller would land on, in the same terms as faller['row']
+        if not self.faller:
+            return None
+        r = self.faller['row']
+        c = self.faller['col']
+        if self.faller['orientation'] == 'horizontal':
+            return max(r, min(self._floor_below(r, c), self._floor_below(r, c + 1)))
+        return max(r, self._floor_below(r, c))
+
+    def hard_drop(self):
+        # Moves the faller straight to where it would land; like a normal
+        # landing, it freezes on the next tick.
+        if not self.faller:
+            return
+        row = self.landing_row()
+        if row != self.faller['row']:
+            self.faller['row'] = row
+            self._emit('faller_moved', row=row, col=self.faller['col'])
+        self.faller['state'] = 'landed'
+        self._emit('faller_landed', row=row, col=self.faller['col'])
 
     def insert_virus(self, row: int, col: int, color: str):
         if 0 <= row < self.rows and 0 <= col < self.cols:
-            self.field[row][col] = color.lower()
+            self._set_cell(row, col, color.lower())
             self.direct_input_mode = True  # Switch to direct input mode
+            self._emit('virus_inserted', row=row, col=col, color=color.lower())
 
     def pass_time(self):
         if not self.faller:
             # First check for matches
             matched = self.find_matches()
             if matched:
+                self._emit('cells_matched', cells=matched, cause='tick')
                 self.remove_matches(matched)
             # Always apply gravity, even if there were no matches
             self.apply_gravity()
@@ -189,23 +473,26 @@ class DrMario:
         if self.faller['state'] == 'falling':
             if can_fall:
                 self.faller['row'] += 1
+                self._emit('faller_moved', row=r + 1, col=c)
             else:
                 self.faller['state'] = 'landed'
+                self._emit('faller_landed', row=r, col=c)
         elif self.faller['state'] == 'landed':
             # First freeze the faller in place
             if self.faller['orientation'] == 'horizontal':
-                self.field[r][c] = self.faller['left']
-                self.field[r][c + 1] = self.faller['right']
+                self._set_cell(r, c, self.faller['left'])
+                self._set_cell(r, c + 1, self.faller['right'])
             else:
-                self.field[r - 1][c] = self.faller['left']
-                self.field[r][c] = self.faller['right']
+                self._set_cell(r - 1, c, self.faller['left'])
+                self._set_cell(r, c, self.faller['right'])
             self.faller = None
+            self._emit('faller_frozen', row=r, col=c)
 
             # Check for matches
             matched = self.find_matches()
             if matched:
-                # First print the field to show the matches with asterisks
-                self.print_field()
+                # Renderers show the matches with asterisks at this point
+                self._emit('cells_matched', cells=matched, cause='freeze')
                 # Then remove matches and apply gravity
                 self.remove_matches(matched)
             # Always apply gravity after freezing, even if there were no matches
@@ -230,44 +517,73 @@ class DrMario:
         return result
 
     def find_matches(self):
+        self._rescan_dirty()
         matched = set()
         faller_cells = self.get_faller_cells()
 
-        # Check for horizontal matches first
-        for r in range(self.rows):
-            for c in range(self.cols - 3):
-                ch = self.field[r][c]
-                if ch == ' ' or (r, c) in faller_cells:
-                    continue
-                if ch.upper() == self.field[r][c + 1].upper() == self.field[r][c + 2].upper() == self.field[r][c + 3].upper():
-                    if not any((r, col) in faller_cells for col in [c, c + 1, c + 2, c + 3]):
-                        if ch.islower():
-                            if all(self.field[r][col].islower() for col in [c, c + 1, c + 2, c + 3]):
-                                matched.update([(r, c), (r, c + 1), (r, c + 2), (r, c + 3)])
-                        else:
-                            matched.update([(r, c), (r, c + 1), (r, c + 2), (r, c + 3)])
-
-        # Check for vertical matches
-        for c in range(self.cols):
-            for r in range(self.rows - 3):
-                ch = self.field[r][c]
-                if ch == ' ' or (r, c) in faller_cells:
-                    continue
-                if ch.upper() == self.field[r + 1][c].upper() == self.field[r + 2][c].upper() == self.field[r + 3][c].upper():
-                    if not any((row, c) in faller_cells for row in [r, r + 1, r + 2, r + 3]):
-                        matched.update([(r, c), (r + 1, c), (r + 2, c), (r + 3, c)])
+        # A run that overlaps the faller does not count while it is there
+        for r, c in self._h_runs:
+            if not faller_cells or not any((r, col) in faller_cells for col in [c, c + 1, c + 2, c + 3]):
+                matched.update([(r, c), (r, c + 1), (r, c + 2), (r, c + 3)])
+
+        for r, c in self._v_runs:
+            if not faller_cells or not any((row, c) in faller_cells for row in [r, r + 1, r + 2, r + 3]):
+                matched.update([(r, c), (r + 1, c), (r + 2, c), (r + 3, c)])
 
         return matched
 
+    def _rescan_dirty(self):
+        # Only the windows of four that contain a changed cell can have
+        # started or stopped being a run since the last scan.
+        h_windows = set()
+        v_windows = set()
+        for r, c in self._dirty:
+            for start in range(max(0, c - 3), min(c, self.cols - 4) + 1):
+                h_windows.add((r, start))
+            for start in range(max(0, r - 3), min(r, self.rows - 4) + 1):
+                v_windows.add((start, c))
+        self._dirty.clear()
+
+        for r, c in h_windows:
+            if self._is_h_run(r, c):
+                self._h_runs.add((r, c))
+            else:
+                self._h_runs.discard((r, c))
+
+        for r, c in v_windows:
+            if self._is_v_run(r, c):
+                self._v_runs.add((r, c))
+            else:
+                self._v_runs.discard((r, c))
+
+    def _is_h_run(self, r: int, c: int) -> bool:
+        row = self.field[r]
+        ch = row[c]
+        if ch == ' ':
+            return False
+        if ch.upper() == row[c + 1].upper() == row[c + 2].upper() == row[c + 3].upper():
+            # Viruses only match other viruses horizontally
+            if ch.islower():
+                return all(row[col].islower() for col in [c, c + 1, c + 2, c + 3])
+            return True
+        return False
+
+    def _is_v_run(self, r: int, c: int) -> bool:
+        ch = self.field[r][c]
+        if ch == ' ':
+            return False
+        return ch.upper() == self.field[r + 1][c].upper() == self.field[r + 2][c].upper() == self.field[r + 3][c].upper()
+
     def remove_matches(self, matched):
+        had_viruses = self._virus_total > 0
         for r, c in matched:
-            if self.field[r][c] == 'R' and c + 1 < self.cols and self.field[r][c + 1] == 'Y':
-                self.field[r][c] = ' '
-            else:
-                self.field[r][c] = ' '
+            self._set_cell(r, c, ' ')
+        if had_viruses and self._virus_total == 0:
+            self._emit('level_cleared')
 
     def apply_gravity(self):
         moved = False
+        fell = []
         for c in range(self.cols):
             # Move each piece down only one row per pass_time
             # Start from second-to-last row and move up
@@ -287,20 +603,211 @@ class DrMario:
                 # If it's a horizontal pair and we can move both pieces down
                 if is_horizontal_pair and self.field[r + 1][c] == ' ' and self.field[r + 1][c + 1] == ' ':
                     # Move both pieces down together
-                    self.field[r + 1][c] = self.field[r][c]
-                    self.field[r + 1][c + 1] = self.field[r][c + 1]
-                    self.field[r][c] = ' '
-                    self.field[r][c + 1] = ' '
+                    self._set_cell(r + 1, c, self.field[r][c])
+                    self._set_cell(r + 1, c + 1, self.field[r][c + 1])
+                    self._set_cell(r, c, ' ')
+                    self._set_cell(r, c + 1, ' ')
                     moved = True
+                    fell.extend([(r, c), (r, c + 1)])
                     break
                 # If it's a single piece and we can move it down
                 elif not is_horizontal_pair and self.field[r + 1][c] == ' ':
-                    self.field[r + 1][c] = self.field[r][c]
-                    self.field[r][c] = ' '
+                    self._set_cell(r + 1, c, self.field[r][c])
+                    self._set_cell(r, c, ' ')
                     moved = True
+                    fell.append((r, c))
                     break
+        if fell:
+            # Each cell listed moved from (r, c) to (r + 1, c)
+            self._emit('cells_fell', cells=fell)
         return moved
 
+    def settle(self, record_chain: bool = False) -> List[List[str]]:
+        # Resolves the whole chain reaction at once: the clears and gravity
+        # steps that pass_time makes while there is no faller, repeated
+        # until nothing changes, so the field ends up exactly where ticking
+        # would leave it.  Pieces fall a row per step and only the lowest
+        # one in a column moves, so when a run forms (and which pill halves
+        # fall together) depends on every step; no shortcut drop agrees.
+        # Returns the field after each clear and before each clear that
+        # follows a fall, plus the final field, when record_chain is set,
+        # otherwise just the final field.
+        if self.faller:
+            raise ValueError('Cannot settle the field while a faller is active')
+
+        chain = []
+        fell = False
+        while True:
+            matched = self.find_matches()
+            if matched:
+                if fell and record_chain:
+                    chain.append(self.field_lines())
+                fell = False
+                self._emit('cells_matched', cells=matched, cause='settle')
+                self.remove_matches(matched)
+                if record_chain:
+                    chain.append(self.field_lines())
+            if self.apply_gravity():
+                fell = True
+            elif not matched:
+                break
+
+        if fell or not record_chain:
+            chain.append(self.field_lines())
+        return chain
+
+    def field_lines(self) -> List[str]:
+        return [''.join(row) for row in self.field]
+
+    def field_hash(self) -> int:
+        # Zobrist hash of the field alone
+        return self._field_hash ^ _ZOBRIST_KEYS['size', self.rows, self.cols]
+
+    def zobrist_hash(self) -> int:
+        # 64-bit hash of everything that decides how the game goes on: the
+        # field (kept up to date by _set_cell), the faller, game over, and
+        # whether the next tick is the one that forces a landing.  Equal
+        # states hash equally in every process.
+        h = self.field_hash()
+        faller = self.faller
+        if faller:
+            h ^= _ZOBRIST_KEYS['faller', faller['row'], faller['col'], faller['orientation'],
+                               faller['left'], faller['right'], faller['state']]
+            h ^= _ZOBRIST_KEYS['ticks', min(self.ticks_since_spawn, 2)]
+        if self.is_game_over:
+            h ^= _ZOBRIST_KEYS['game_over']
+        return h
+
+    def snapshot(self) -> bytes:
+        # The whole game state as an immutable blob for restore(); the
+        # event listener is not part of it.
+        rows = self.rows
+        cols = self.cols
+
+        text = ''.join(map(''.join, self.field))
+        if len(text) == rows * cols and text.isascii():
+            cell_size = 1
+            cells = text.encode('ascii')
+        else:
+            encoded = [cell.encode('utf-8') for row in self.field for cell in row]
+            cell_size = 1 + max(len(value) for value in encoded)
+            if cell_size > 256:
+                raise ValueError('Cell values are too long to snapshot')
+            cells = b''.join(bytes([len(value)]) + value.ljust(cell_size - 1, b'\0') for value in encoded)
+
+        flags = 0
+        if self.is_game_over:
+            flags |= _SNAPSHOT_GAME_OVER
+        if self.direct_input_mode:
+            flags |= _SNAPSHOT_DIRECT_INPUT
+        faller = self.faller
+        left = right = b''
+        faller_row = faller_col = 0
+        if faller:
+            flags |= _SNAPSHOT_FALLER
+            if faller['orientation'] == 'vertical':
+                flags |= _SNAPSHOT_VERTICAL
+            elif faller['orientation'] != 'horizontal':
+                raise ValueError(f"Cannot snapshot orientation {faller['orientation']!r}")
+            if faller['state'] == 'landed':
+                flags |= _SNAPSHOT_LANDED
+            elif faller['state'] != 'falling':
+                raise ValueError(f"Cannot snapshot faller state {faller['state']!r}")
+            faller_row = faller['row']
+            faller_col = faller['col']
+            left = faller['left'].encode('utf-8')
+            right = faller['right'].encode('utf-8')
+
+        header = _SNAPSHOT_HEADER.pack(
+            _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, cell_size, rows, cols, flags,
+            faller_row, faller_col, self.ticks_since_spawn,
+            len(left), len(right), self._field_hash)
+        return b''.join((header, cells, struct.pack(f'<{cols}H', *self._column_tops), left, right))
+
+    def restore(self, blob):
+        # Accepts anything snapshot() returned, or a buffer (memoryview,
+        # mmap, shared memory) holding one; the blob is only read.
+        view = memoryview(blob)
+        (magic, version, cell_size, rows, cols, flags, faller_row, faller_col,
+         ticks, left_len, right_len, field_hash) = _SNAPSHOT_HEADER.unpack_from(view)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+            raise ValueError('Not a DrMario snapshot')
+
+        offset = _SNAPSHOT_HEADER.size
+        size = rows * cols * cell_size
+        cells = view[offset:offset + size]
+        offset += size
+        dirty = set()
+        h_runs = set()
+        v_runs = set()
+        if cell_size == 1:
+            text = str(cells, 'ascii')
+            lines = [text[start:start + cols] for start in range(0, size, cols)]
+            field = [list(line) for line in lines]
+            virus_counts = {value: text.count(value) for value in 'ryb'}
+
+            across = '\n'.join(lines)
+            for match in _RUN_OF_FOUR.finditer(across):
+                i = match.start()
+                # A run that starts on a virus only counts if it is all viruses
+                if not across[i].islower() or across[i:i + 4].islower():
+                    h_runs.add(divmod(i, cols + 1))
+            down = '\n'.join(map(''.join, zip(*lines)))
+            for match in _RUN_OF_FOUR.finditer(down):
+                c, r = divmod(match.start(), rows + 1)
+                v_runs.add((r, c))
+        else:
+            # Runs of longer cell values are left to the first rescan
+            dirty = {(r, c) for r in range(rows) for c in range(cols)}
+            values = [str(cells[start + 1:start + 1 + cells[start]], 'utf-8')
+                      for start in range(0, size, cell_size)]
+            field = [values[start:start + cols] for start in range(0, len(values), cols)]
+            virus_counts = {'r': 0, 'y': 0, 'b': 0}
+            for value in values:
+                if value in VIRUS_VALUES:
+                    virus_counts[value] = virus_counts.get(value, 0) + 1
+
+        column_tops = list(struct.unpack_from(f'<{cols}H', view, offset))
+        offset += 2 * cols
+
+        if flags & _SNAPSHOT_FALLER:
+            self.faller = {
+                'row': faller_row,
+                'col': faller_col,
+                'orientation': 'vertical' if flags & _SNAPSHOT_VERTICAL else 'horizontal',
+                'left': str(view[offset:offset + left_len], 'utf-8'),
+                'right': str(view[offset + left_len:offset + left_len + right_len], 'utf-8'),
+                'state': 'landed' if flags & _SNAPSHOT_LANDED else 'falling'
+            }
+        else:
+            self.faller = None
+
+        self.rows = rows
+        self.cols = cols
+        self.field = field
+        self.is_game_over = bool(flags & _SNAPSHOT_GAME_OVER)
+        self.direct_input_mode = bool(flags & _SNAPSHOT_DIRECT_INPUT)
+        self.ticks_since_spawn = ticks
+        self._dirty = dirty
+        self._h_runs = h_runs
+        self._v_runs = v_runs
+        self._virus_counts = virus_counts
+        self._virus_total = sum(virus_counts.values())
+        self._row_versions = [0] * rows
+        self._row_cache = {}
+        self._footer = ' ' + '-' * (cols * 3) + ' '
+        self._column_tops = column_tops
+        self._field_hash = field_hash
+
+def is_direct_input(command: str) -> bool:
+    return all(c in 'RYBryb ' for c in command)
+
+def print_freeze_matches(game: DrMario, event: dict):
+    # Event listener for the CLIs: when a frozen faller completes a run,
+    # the board is shown with the matches before they are cleared.
+    if event['type'] == 'cells_matched' and event['cause'] == 'freeze':
+        game.print_field()
+
 def parse_line_content(line: str, cols: int) -> str:
     content = line.strip()
     # Pad with spaces to match the required length
@@ -308,3 +815,35 @@ def parse_line_content(line: str, cols: int) -> str:
         content += ' '
     # Truncate if too long
     return content[:cols]
+
+
+def check_settle(boards: int = 3000, seed: int = 0) -> int:
+    # Settles random boards and compares each with the same board ticked
+    # until nothing changes.  Returns the number that differ.
+    rnd = random.Random(seed)
+    failures = 0
+    for _ in range(boards):
+        rows = rnd.randint(4, 14)
+        cols = rnd.randint(3, 9)
+        density = rnd.random()
+        lines = [''.join(rnd.choice('RYBRYBryb') if rnd.random() < density else ' ' for _ in range(cols))
+                 for _ in range(rows)]
+        settled = DrMario()
+        settled.initialize(rows, cols)
+        settled.set_field_contents(lines)
+        ticked = DrMario()
+        ticked.initialize(rows, cols)
+        ticked.set_field_contents(lines)
+
+        final = settled.settle()[-1]
+        previous = None
+        while previous != ticked.field_lines():
+            previous = ticked.field_lines()
+            ticked.pass_time()
+        if final != previous:
+            failures += 1
+    return failures
+
+
+if __name__ == '__main__':
+    print(f"boards where settle() and ticking differ: {check_settle()}")
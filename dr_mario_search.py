@@ -0,0 +1,307 @@
+import random
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from dr_mario_logic import DrMario
+
+
+class TranspositionTable:
+    """Bounded map from DrMario.zobrist_hash() to search results.
+
+    With policy='lru' the least recently used entry is dropped once the
+    table is full.  With policy='depth' the table is a fixed array of slots
+    indexed by the hash, and a new entry only displaces one searched to the
+    same depth or less, so deep results are not pushed out by shallow ones.
+    Either way store() and get() are O(1).
+    """
+
+    def __init__(self, capacity: int = 1 << 16, policy: str = 'lru'):
+        if capacity <= 0:
+            raise ValueError('Capacity must be positive')
+        if policy not in ('lru', 'depth'):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.capacity = capacity
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lru: 'OrderedDict[int, tuple]' = OrderedDict()
+        self._slots: List[Optional[tuple]] = [None] * capacity if policy == 'depth' else []
+        self._size = 0
+
+    def _find(self, key: int) -> Optional[tuple]:
+        if self.policy == 'lru':
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+            return entry
+        entry = self._slots[key % self.capacity]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def get(self, key: int, default: Any = None, min_depth: int = 0) -> Any:
+        # Entries searched to less than min_depth count as misses
+        entry = self._find(key)
+        if entry is None or entry[1] < min_depth:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[2]
+
+    def depth(self, key: int) -> Optional[int]:
+        entry = self._find(key)
+        return None if entry is None else entry[1]
+
+    def store(self, key: int, value: Any, depth: int = 0) -> bool:
+        # Returns whether the entry was kept
+        entry = (key, depth, value)
+        if self.policy == 'lru':
+            if key in self._lru:
+                self._lru.move_to_end(key)
+            elif len(self._lru) >= self.capacity:
+                self._lru.popitem(last=False)
+                self.evictions += 1
+            self._lru[key] = entry
+            return True
+
+        index = key % self.capacity
+        old = self._slots[index]
+        if old is None:
+            self._size += 1
+        elif old[1] > depth:
+            # Also for the same key: a shallower search never replaces a deeper one
+            return False
+        elif old[0] != key:
+            self.evictions += 1
+        self._slots[index] = entry
+        return True
+
+    def __contains__(self, key: int) -> bool:
+        if self.policy == 'lru':
+            return key in self._lru
+        entry = self._slots[key % self.capacity]
+        return entry is not None and entry[0] == key
+
+    def __len__(self) -> int:
+        return len(self._lru) if self.policy == 'lru' else self._size
+
+    def clear(self):
+        self._lru.clear()
+        if self.policy == 'depth':
+            self._slots = [None] * self.capacity
+        self._size = 0
+        self.hits = self.misses = self.evictions = 0
+
+
+class Placement:
+    # Where the faller freezes and the shortest input that gets it there.
+    # row, col and orientation mean what they do in game.faller; left and
+    # right are the colors in the order they end up in.  grounded is False
+    # when the faller freezes over an empty cell and gravity takes it on.
+    __slots__ = ('row', 'col', 'orientation', 'left', 'right', 'path', 'grounded')
+
+    def __init__(self, row: int, col: int, orientation: str, left: str, right: str,
+                 path: Tuple[str, ...], grounded: bool = True):
+        self.row = row
+        self.col = col
+        self.orientation = orientation
+        self.left = left
+        self.right = right
+        self.path = path
+        self.grounded = grounded
+
+    def cells(self) -> Dict[Tuple[int, int], str]:
+        if self.orientation == 'horizontal':
+            return {(self.row, self.col): self.left, (self.row, self.col + 1): self.right}
+        return {(self.row - 1, self.col): self.left, (self.row, self.col): self.right}
+
+    def __repr__(self):
+        return (f"Placement(row={self.row}, col={self.col}, orientation={self.orientation!r}, "
+                f"left={self.left!r}, right={self.right!r}, path={list(self.path)!r}, "
+                f"grounded={self.grounded})")
+
+
+class MovePlanner:
+    """Lists where the current faller can come to rest, and how.
+
+    placements() runs a breadth-first search over (row, col, orientation,
+    color order, landed, ticks since spawn) using the same rules as
+    move_faller, rotate_faller and tick(), so every path is the shortest
+    sequence of step() commands ('<', '>', 'A', 'B' and '' for a tick,
+    plus 'instant drop' when hard_drop is set) ending with the tick that
+    freezes the faller.  The colors play no part in the search, so results
+    are cached per field hash and starting state and only recolored on a
+    hit.
+    """
+
+    def __init__(self, capacity: int = 4096, hard_drop: bool = False):
+        self.hard_drop = hard_drop
+        self.table = TranspositionTable(capacity)
+        self._commands = ('<', '>', 'A', 'B', '') + (('instant drop',) if hard_drop else ())
+
+    def placements(self, game: DrMario) -> List[Placement]:
+        faller = game.faller
+        if not faller or game.is_game_over:
+            return []
+
+        start = (faller['row'], faller['col'], faller['orientation'] == 'vertical', False,
+                 faller['state'] == 'landed', min(game.ticks_since_spawn, 3))
+        key = (game.field_hash(), start)
+        reachable = self.table.get(key)
+        if reachable is None:
+            reachable = self._search(game, start)
+            self.table.store(key, reachable)
+
+        left = faller['left']
+        right = faller['right']
+        return [Placement(row, col, 'vertical' if vertical else 'horizontal',
+                          right if swapped else left, left if swapped else right, path, grounded)
+                for row, col, vertical, swapped, path, grounded in reachable]
+
+    def _search(self, game: DrMario, start: tuple) -> List[tuple]:
+        field = game.field
+        rows = game.rows
+        cols = game.cols
+
+        def can_fall(row, col, vertical):
+            if row + 1 >= rows:
+                return False
+            below = field[row + 1]
+            return below[col] == ' ' and (vertical or below[col + 1] == ' ')
+
+        def apply(state, command):
+            # The state after command, None if it changes nothing, or
+            # 'frozen' if it freezes the faller
+            row, col, vertical, swapped, landed, ticks = state
+            if command == '':
+                if landed:
+                    return 'frozen'
+                if can_fall(row, col, vertical):
+                    row += 1
+                else:
+                    landed = True
+                # tick() forces a landing on the second tick after a spawn
+                if ticks + 1 == 2:
+                    landed = True
+                return (row, col, vertical, swapped, landed, min(ticks + 1, 3))
+            if command in ('<', '>'):
+                new_col = col + (-1 if command == '<' else 1)
+                if vertical:
+                    if 0 <= new_col < cols and field[row][new_col] == ' ' and field[row - 1][new_col] == ' ':
+                        return (row, new_col, vertical, swapped, landed, ticks)
+                elif 0 <= new_col and new_col + 1 < cols and \
+                        field[row][new_col] == ' ' and field[row][new_col + 1] == ' ':
+                    return (row, new_col, vertical, swapped, landed, ticks)
+                return None
+            if command in ('A', 'B'):
+                if not vertical:
+                    if row - 1 >= 0 and field[row - 1][col] == ' ':
+                        return (row, col, True, swapped, landed, ticks)
+                elif col + 1 < cols and field[row][col + 1] == ' ':
+                    # Rotating counterclockwise back to horizontal swaps the colors
+                    return (row, col, False, swapped != (command == 'B'), landed, ticks)
+                return None
+            # instant drop
+            while can_fall(row, col, vertical):
+                row += 1
+            return (row, col, vertical, swapped, True, ticks)
+
+        found = {}
+        seen = {start}
+        queue = deque([(start, ())])
+        while queue:
+            state, path = queue.popleft()
+            for command in self._commands:
+                result = apply(state, command)
+                if result is None or result == state:
+                    continue
+                if result == 'frozen':
+                    placement = state[:4]
+                    if placement not in found:
+                        found[placement] = (path + (command,), not can_fall(*state[:3]))
+                elif result not in seen:
+                    seen.add(result)
+                    queue.append((result, path + (command,)))
+
+        return [(row, col, vertical, swapped, path, grounded)
+                for (row, col, vertical, swapped), (path, grounded) in found.items()]
+
+
+def check_planner(games: int = 100, seed: int = 0, hard_drop: bool = False) -> int:
+    # Replays every planned path through step() on a restored copy of the
+    # game and checks the faller freezes where the plan says.  Returns the
+    # number of paths that did not.
+    rnd = random.Random(seed)
+    planner = MovePlanner(hard_drop=hard_drop)
+    failures = 0
+    for _ in range(games):
+        rows = rnd.randint(4, 14)
+        cols = rnd.randint(3, 9)
+        game = DrMario()
+        game.initialize(rows, cols)
+        game.set_field_contents([' ' * cols] * 3 + [
+            ''.join(rnd.choice('RYBryb    ') for _ in range(cols)) for _ in range(rows - 3)])
+        game.spawn_faller(rnd.choice('RYB'), rnd.choice('RYB'))
+        for _ in range(rnd.randint(0, 2)):
+            game.step(rnd.choice(['<', '>', 'A', 'B', '']))
+        if not game.faller:
+            continue
+
+        blob = game.snapshot()
+        for placement in planner.placements(game):
+            copy = DrMario()
+            copy.restore(blob)
+            for command in placement.path[:-1]:
+                copy.step(command)
+            expected = {'row': placement.row, 'col': placement.col, 'orientation': placement.orientation,
+                        'left': placement.left, 'right': placement.right, 'state': 'landed'}
+            events = copy.step(placement.path[-1]) if copy.faller == expected else []
+            if not any(event['type'] == 'faller_frozen' for event in events):
+                failures += 1
+    return failures
+
+
+def check_hashes(games: int = 200, commands: int = 80, seed: int = 0) -> int:
+    # Plays random commands and compares the incrementally kept hash with
+    # the hash of the same state rebuilt from scratch.  Returns the number
+    # of mismatches.
+    rnd = random.Random(seed)
+    script = ['', '', '', 'A', 'B', '<', '>', 'F R Y', 'F B B', 'F Y R',
+              'V 5 2 r', 'V 6 1 B', 'instant drop', 'EMPTY', 'RY  b']
+    failures = 0
+    for _ in range(games):
+        rows = rnd.randint(4, 14)
+        cols = rnd.randint(3, 9)
+        game = DrMario()
+        game.initialize(rows, cols)
+        game.set_field_contents([' ' * cols] * 2 + [
+            ''.join(rnd.choice('RYBryb  ') for _ in range(cols)) for _ in range(rows - 2)])
+        for _ in range(commands):
+            try:
+                game.step(rnd.choice(script))
+            except (IndexError, ValueError):
+                pass
+
+            fresh = DrMario()
+            fresh.initialize(rows, cols)
+            fresh.set_field_contents(game.field_lines())
+            fresh.faller = dict(game.faller) if game.faller else None
+            fresh.is_game_over = game.is_game_over
+            fresh.ticks_since_spawn = game.ticks_since_spawn
+            if fresh.zobrist_hash() != game.zobrist_hash():
+                failures += 1
+                break
+
+    # A depth-preferred table keeps the deeper result for a key it has
+    table = TranspositionTable(4, policy='depth')
+    table.store(1, 'deep', depth=3)
+    table.store(1, 'shallow', depth=1)
+    if table.get(1) != 'deep' or table.depth(1) != 3:
+        failures += 1
+    return failures
+
+
+if __name__ == '__main__':
+    print(f"hash mismatches: {check_hashes()}")
+    print(f"planner mismatches: {check_planner()} (with instant drop: {check_planner(hard_drop=True)})")
@@ -0,0 +1,406 @@
+# dr_mario_server.py
+#
+# Hosts many games in one process.  Each TCP (or Unix socket) connection
+# is one game speaking a2.py's line protocol: the board size on two lines,
+# then commands, with the output a2.py would print sent back.  The
+# connection closes where a2.py would exit (Q, game over, a bad size).
+#
+#   python dr_mario_server.py serve [--port 5050 | --unix PATH] [--engine NAME]
+#                                   [--max-sessions N] [--idle-timeout S]
+#   python dr_mario_server.py client [--port 5050 | --unix PATH] [--sessions N]
+#                                    [--verify]
+#   python dr_mario_server.py check
+#
+# Input is read a chunk at a time and a chunk's output is written in one
+# go; the next chunk is not read until the client has taken the output
+# (per-connection backpressure).  Sessions idle for --idle-timeout seconds
+# are closed, and connections over --max-sessions are refused.  client is
+# a stub that plays random scripts over many connections at once and, with
+# --verify, checks the output against a2.run_batch.  check runs a server
+# and the client in one process on a free port.
+
+import argparse
+import asyncio
+import contextlib
+import io
+import signal
+import sys
+import time
+from typing import Dict, List, Optional
+
+import a2
+from dr_mario_backends import DEFAULT_BACKEND, ENV_VAR, backend_names, load_backend, selected_backend
+from dr_mario_logic import parse_line_content, print_freeze_matches
+
+_READ_SIZE = 1 << 16
+_BACKLOG = 4096
+# Longest line a session buffers; a client sending more without a newline
+# is disconnected
+_MAX_LINE = 1 << 20
+# Seconds a refused client gets to read the refusal before it is closed
+_REFUSE_TIMEOUT = 1.0
+# Lines a session plays before letting the other sessions run
+_LINES_PER_TURN = 256
+
+
+class Session:
+    # One game fed line by line, printing what a2.main prints for the same
+    # input when stdin is not a terminal
+    def __init__(self, engine):
+        self.engine = engine
+        self.game = None
+        self.rows: Optional[int] = None
+        self.cols: Optional[int] = None
+        self.closed = False
+        self.commands = 0
+        self._contents: Optional[List[str]] = None
+
+    def feed(self, line: str):
+        if self.closed:
+            return
+        if self.game is None:
+            self._read_size(line)
+        elif self._contents is not None:
+            self._contents.append(parse_line_content(line.strip(), self.cols))
+            if len(self._contents) == self.rows:
+                lines, self._contents = self._contents, None
+                self._run('CONTENTS', lines)
+        else:
+            command = line.strip()
+            if command == 'Q':
+                self.closed = True
+            elif command == 'CONTENTS':
+                self._contents = []
+            elif a2.is_game_command(command):
+                self._run(command)
+
+    def _read_size(self, line: str):
+        try:
+            if self.rows is None:
+                self.rows = int(line.strip())
+                return
+            cols = int(line.strip())
+            if self.rows <= 0 or cols <= 0:
+                raise ValueError("Dimensions must be positive numbers")
+        except ValueError as e:
+            print(f"Error: {e}")
+            self.closed = True
+            return
+
+        self.cols = cols
+        self.game = self.engine()
+        self.game.initialize(self.rows, cols)
+        self.game.event_listener = print_freeze_matches
+
+    def _run(self, command: str, lines: Optional[List[str]] = None):
+        self.commands += 1
+        try:
+            events = self.game.step(command, lines)
+            self.game.print_field()
+            if any(event['type'] == 'game_over' for event in events):
+                self.closed = True
+        except Exception:
+            pass
+
+
+class GameServer:
+    def __init__(self, engine, max_sessions: int = 10000, idle_timeout: float = 300.0):
+        self.engine = engine
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        # writer -> time of the last input, for the idle sweep
+        self._last_input: Dict[asyncio.StreamWriter, float] = {}
+        self.stats = {'sessions': 0, 'commands': 0, 'refused': 0, 'evicted': 0, 'peak_sessions': 0}
+
+    @property
+    def active(self) -> int:
+        return len(self._last_input)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        if self.active >= self.max_sessions:
+            self.stats['refused'] += 1
+            try:
+                writer.write(b'Error: too many sessions\n')
+                writer.write_eof()
+                with contextlib.suppress(OSError, asyncio.TimeoutError):
+                    await asyncio.wait_for(reader.read(), _REFUSE_TIMEOUT)
+            finally:
+                await self._close(writer)
+            return
+
+        session = Session(self.engine)
+        self._last_input[writer] = loop.time()
+        self.stats['sessions'] += 1
+        self.stats['peak_sessions'] = max(self.stats['peak_sessions'], self.active)
+        pending = b''
+        try:
+            while not session.closed:
+                data = await reader.read(_READ_SIZE)
+                self._last_input[writer] = loop.time()
+                if data:
+                    *lines, pending = (pending + data).split(b'\n')
+                    if len(pending) > _MAX_LINE:
+                        break
+                else:
+                    # As input() does, a last line without a newline counts
+                    lines, pending = ([pending] if pending else []), b''
+
+                # A big chunk is played a batch at a time, letting the
+                # other sessions run in between; stdout is only redirected
+                # while nothing else can run
+                for start in range(0, len(lines), _LINES_PER_TURN):
+                    if start:
+                        await asyncio.sleep(0)
+                    out = io.StringIO()
+                    commands = session.commands
+                    with contextlib.redirect_stdout(out):
+                        for line in lines[start:start + _LINES_PER_TURN]:
+                            session.feed(line.decode('utf-8', 'replace'))
+                            if session.closed:
+                                break
+                    self.stats['commands'] += session.commands - commands
+
+                    output = out.getvalue()
+                    if output:
+                        writer.write(output.encode('utf-8'))
+                        await writer.drain()
+                    if session.closed:
+                        break
+                if not data:
+                    break
+
+            if session.closed:
+                # Closing with input still unread would reset the
+                # connection and could lose the output, so end our side
+                # and drop the rest of the input until the client closes
+                # (or the idle sweep ends it)
+                writer.write_eof()
+                while await reader.read(_READ_SIZE):
+                    self._last_input[writer] = loop.time()
+        except OSError:
+            pass
+        finally:
+            # Runs on cancellation too, which then carries on to the caller
+            del self._last_input[writer]
+            await self._close(writer)
+
+    async def _close(self, writer: asyncio.StreamWriter):
+        writer.close()
+        with contextlib.suppress(OSError):
+            await writer.wait_closed()
+
+    async def evict_idle(self):
+        # Closing the transport ends the pending read in handle()
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(max(0.05, self.idle_timeout / 4))
+            cutoff = loop.time() - self.idle_timeout
+            for writer, last in list(self._last_input.items()):
+                if last < cutoff:
+                    self.stats['evicted'] += 1
+                    writer.transport.abort()
+
+    async def close_all(self):
+        # Ends the open sessions the way the idle sweep does, so their
+        # handlers finish on their own instead of being cancelled
+        for writer in list(self._last_input):
+            writer.transport.abort()
+        while self._last_input:
+            await asyncio.sleep(0.01)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 5050,
+                    unix: Optional[str] = None) -> asyncio.AbstractServer:
+        # A Unix socket connect over the backlog fails in a way asyncio
+        # takes for success, so leave room for bursts of clients
+        if unix:
+            return await asyncio.start_unix_server(self.handle, unix, backlog=_BACKLOG)
+        return await asyncio.start_server(self.handle, host, port, backlog=_BACKLOG)
+
+
+async def serve(engine, host: str, port: int, unix: Optional[str], max_sessions: int, idle_timeout: float):
+    game_server = GameServer(engine, max_sessions, idle_timeout)
+    server = await game_server.start(host, port, unix)
+    sweeper = asyncio.create_task(game_server.evict_idle())
+    where = unix or ', '.join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"serving on {where}", file=sys.stderr)
+    start = time.perf_counter()
+    # Stop as for Ctrl+C when run in the background
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        sweeper.cancel()
+        await game_server.close_all()
+        elapsed = time.perf_counter() - start
+        print(_format_stats(game_server.stats, elapsed), file=sys.stderr)
+
+
+def _format_stats(stats: dict, elapsed: float) -> str:
+    return (f"{stats['sessions']} sessions (peak {stats['peak_sessions']}), {stats['commands']} commands "
+            f"in {elapsed:.2f}s ({stats['commands'] / elapsed if elapsed > 0 else 0:,.0f} commands/s), "
+            f"{stats['refused']} refused, {stats['evicted']} evicted")
+
+
+async def play(lines: List[str], host: str, port: int, unix: Optional[str]) -> str:
+    # Sends a script over one connection and returns everything sent back
+    if unix:
+        reader, writer = await asyncio.open_unix_connection(unix)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    async def send():
+        # Runs beside the reads, so a server waiting for us to take its
+        # output never stalls us.  The server may have closed already
+        # (Q, game over, refused), leaving the rest unsent.
+        with contextlib.suppress(OSError):
+            writer.write(''.join(line + '\n' for line in lines).encode('utf-8'))
+            await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+
+    sender = asyncio.create_task(send())
+    try:
+        output = await reader.read()
+    finally:
+        await sender
+        writer.close()
+        with contextlib.suppress(OSError):
+            await writer.wait_closed()
+    return output.decode('utf-8')
+
+
+def expected_output(lines: List[str], engine) -> str:
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        a2.run_batch(lines, engine)
+    return out.getvalue()
+
+
+async def run_client(host: str, port: int, unix: Optional[str], sessions: int, concurrency: int,
+                     seed: int = 0, max_commands: int = 60, verify_engine=None) -> dict:
+    # Plays `sessions` random scripts, at most `concurrency` at once
+    from dr_mario_fuzz import case_random, random_case, script_lines
+
+    limit = asyncio.Semaphore(concurrency)
+    scripts = [script_lines(random_case(case_random(seed, index), max_commands=max_commands))
+               for index in range(sessions)]
+    mismatches = []
+
+    async def one(index: int):
+        async with limit:
+            output = await play(scripts[index], host, port, unix)
+        if verify_engine is not None and output != expected_output(scripts[index], verify_engine):
+            mismatches.append(index)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(sessions)))
+    elapsed = time.perf_counter() - start
+    lines = sum(len(script) for script in scripts)
+    return {'sessions': sessions, 'lines': lines, 'seconds': elapsed,
+            'lines_per_second': lines / elapsed if elapsed > 0 else 0.0,
+            'verified': verify_engine is not None, 'mismatches': mismatches}
+
+
+def _format_client(report: dict) -> str:
+    text = (f"{report['sessions']} sessions, {report['lines']} lines in {report['seconds']:.2f}s "
+            f"({report['lines_per_second']:,.0f} lines/s)")
+    if report['verified']:
+        text += f", {len(report['mismatches'])} differ from a2.run_batch"
+    return text
+
+
+async def check(engine, sessions: int = 2000, concurrency: int = 1000, cap: int = 50) -> bool:
+    # Servers and client in one loop: every session's output must match
+    # a2.run_batch, and on a small server a connection over the cap must be
+    # refused and idle sessions evicted
+    game_server = GameServer(engine)
+    server = await game_server.start(port=0)
+    try:
+        port = server.sockets[0].getsockname()[1]
+        report = await run_client('127.0.0.1', port, None, sessions, concurrency, verify_engine=engine)
+        print(_format_client(report), file=sys.stderr)
+        print(_format_stats(game_server.stats, report['seconds']), file=sys.stderr)
+        ok = not report['mismatches']
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    game_server = GameServer(engine, max_sessions=cap, idle_timeout=0.5)
+    server = await game_server.start(port=0)
+    sweeper = asyncio.create_task(game_server.evict_idle())
+    try:
+        port = server.sockets[0].getsockname()[1]
+        idle = [await asyncio.open_connection('127.0.0.1', port) for _ in range(cap)]
+        deadline = time.perf_counter() + 5
+        while game_server.active < cap and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        refused = await play(['4', '4', 'Q'], '127.0.0.1', port, None)
+        ok = ok and refused == 'Error: too many sessions\n'
+
+        # Nothing is sent on the idle connections, so the sweep ends them
+        async def ended(reader: asyncio.StreamReader) -> bool:
+            try:
+                return await asyncio.wait_for(reader.read(), 5) == b''
+            except ConnectionError:
+                return True
+            except asyncio.TimeoutError:
+                return False
+
+        ok = ok and all(await asyncio.gather(*(ended(reader) for reader, _ in idle)))
+        ok = ok and game_server.active == 0 and game_server.stats['evicted'] == cap
+        for _, writer in idle:
+            writer.close()
+        print(f"cap {cap}: {game_server.stats['refused']} refused, {game_server.stats['evicted']} evicted",
+              file=sys.stderr)
+    finally:
+        sweeper.cancel()
+        server.close()
+        await server.wait_closed()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Host many a2.py games in one process.')
+    parser.add_argument('mode', choices=['serve', 'client', 'check'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--unix', help='listen on (or connect to) this Unix socket instead of TCP')
+    parser.add_argument('--engine', choices=backend_names('game'),
+                        help=f'default ${ENV_VAR} or {DEFAULT_BACKEND}')
+    parser.add_argument('--max-sessions', type=int, default=10000)
+    parser.add_argument('--idle-timeout', type=float, default=300.0, help='seconds before an idle game is closed')
+    parser.add_argument('--sessions', type=int, default=1000, help='scripts for client to play')
+    parser.add_argument('--concurrency', type=int, default=500, help='connections client keeps open at once')
+    parser.add_argument('--max-commands', type=int, default=60, help='longest script client sends')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verify', action='store_true', help='check client output against a2.run_batch')
+    args = parser.parse_args()
+    if args.engine is None:
+        try:
+            args.engine = selected_backend([])
+        except ValueError as e:
+            parser.error(str(e))
+    if args.engine not in backend_names('game'):
+        parser.error(f"unknown engine {args.engine!r} in ${ENV_VAR}")
+    engine = load_backend(args.engine)
+
+    if args.mode == 'serve':
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(serve(engine, args.host, args.port, args.unix, args.max_sessions, args.idle_timeout))
+    elif args.mode == 'client':
+        report = asyncio.run(run_client(args.host, args.port, args.unix, args.sessions, args.concurrency,
+                                        args.seed, args.max_commands, engine if args.verify else None))
+        print(_format_client(report), file=sys.stderr)
+        sys.exit(1 if report['mismatches'] else 0)
+    else:
+        ok = asyncio.run(check(engine))
+        print('server check ' + ('passed' if ok else 'FAILED'), file=sys.stderr)
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+# dr_mario_solver.py
+#
+# Searches for a pill sequence that clears a virus layout, given the order
+# the pills will come in.  Beam search: every board in the beam is
+# expanded by each placement MovePlanner finds for the next pill,
+# the children are scored on viruses left, stack height and chain
+# potential, and the best `beam` of them go on to the next pill.  Boards
+# travel between processes as DrMario.snapshot() blobs and each worker
+# keeps its own planner cache.
+#
+#   python dr_mario_solver.py [--beam N] [--workers N] [--grounded] [--queue "RY BB ..."] LEVEL
+#
+# --grounded skips placements that freeze in mid-air.  Those can complete
+# a run at the height they freeze at, so the search is a little weaker
+# without them, but on wide boards they are most of the work.
+#
+# LEVEL is a file with one line per row of the board, as CONTENTS takes
+# them.  Without --queue, --pills random pills are drawn from --seed.
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from dr_mario_logic import DrMario
+from dr_mario_search import MovePlanner
+
+_planner: Optional[MovePlanner] = None
+
+# Windows of four holding three cells of one color and one empty cell; the
+# lookahead makes findall count overlapping windows.
+_NEAR_RUN = re.compile('(?=(' + '|'.join(
+    pattern.replace('X', color) for color in 'RYB'
+    for pattern in ('XXX ', 'XX X', 'X XX', ' XXX')) + '))')
+
+
+def _get_planner() -> MovePlanner:
+    # One planner per process, so its cache lives as long as the worker
+    global _planner
+    if _planner is None:
+        _planner = MovePlanner(hard_drop=True)
+    return _planner
+
+
+def chain_potential(game: DrMario) -> int:
+    # Near runs across or down: one more pill half completes each of them
+    lines = [line.upper() for line in game.field_lines()]
+    across = '\n'.join(lines)
+    down = '\n'.join(map(''.join, zip(*lines)))
+    return len(_NEAR_RUN.findall(across)) + len(_NEAR_RUN.findall(down))
+
+
+def score_board(game: DrMario) -> float:
+    if game.is_game_over:
+        return float('-inf')
+    viruses = sum(game.virus_counts().values())
+    height = game.rows - min((game.column_top(c) for c in range(game.cols)), default=game.rows)
+    return -1000 * viruses - 10 * height + 3 * chain_potential(game)
+
+
+def expand_shard(nodes: List[Tuple[int, bytes]], left: str, right: str,
+                 grounded: bool = False) -> List[tuple]:
+    # Children of each (index, snapshot) for the pill left/right, as
+    # (parent index, commands, snapshot, score, hash, cleared).  The
+    # commands are step() commands, including the ticks it takes the
+    # chain reaction after the freeze to run out.
+    planner = _get_planner()
+    children = []
+    for index, blob in nodes:
+        game = DrMario()
+        game.restore(blob)
+        game.spawn_faller(left, right)
+        if game.is_game_over:
+            continue
+        spawned = game.snapshot()
+
+        # A pill of one color gives the same board both ways round
+        done = set()
+        for placement in planner.placements(game):
+            if grounded and not placement.grounded:
+                continue
+            cells = tuple(sorted(placement.cells().items()))
+            if cells in done:
+                continue
+            done.add(cells)
+
+            child = DrMario()
+            child.restore(spawned)
+            commands = [f'F {left} {right}']
+            for command in placement.path:
+                child.step(command)
+                commands.append(command)
+            while child.step(''):
+                commands.append('')
+            children.append((index, commands, child.snapshot(), score_board(child),
+                             child.zobrist_hash(), not child.contains_virus()))
+    return children
+
+
+def solve(lines: List[str], pills: List[Tuple[str, str]], beam: int = 64, workers: int = 1,
+          grounded: bool = False) -> dict:
+    rows = len(lines)
+    cols = len(lines[0]) if lines else 0
+    game = DrMario()
+    game.initialize(rows, cols)
+    game.set_field_contents(lines)
+
+    start = time.perf_counter()
+    # Each entry: (score, snapshot, commands so far)
+    frontier = [(score_board(game), game.snapshot(), [])]
+    best = frontier[0]
+    nodes = 0
+    pills_used = 0
+    cleared = not game.contains_virus()
+    seen = {game.zobrist_hash()}
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for left, right in pills:
+            if cleared or not frontier:
+                break
+            indexed = list(enumerate(blob for _, blob, _ in frontier))
+            if pool is None:
+                children = expand_shard(indexed, left, right, grounded)
+            else:
+                count = min(len(indexed), workers * 4)
+                shards = [indexed[i::count] for i in range(count)]
+                children = []
+                for shard_children in pool.map(expand_shard, shards, [left] * count, [right] * count,
+                                               [grounded] * count):
+                    children.extend(shard_children)
+            nodes += len(children)
+            pills_used += 1
+
+            # Ties go to the earlier parent, so the result does not depend
+            # on how the beam was sharded
+            children.sort(key=lambda child: child[0])
+            children.sort(key=lambda child: -child[3])
+
+            # A child that clears the board is the answer, whatever the
+            # scores of the others
+            winner = next((child for child in children if child[5]), None)
+            if winner is not None:
+                index, commands, blob, score, _, _ = winner
+                best = (score, blob, frontier[index][2] + commands)
+                cleared = True
+                break
+
+            next_frontier = []
+            for index, commands, blob, score, key, _ in children:
+                if key in seen:
+                    continue
+                seen.add(key)
+                next_frontier.append((score, blob, frontier[index][2] + commands))
+                if len(next_frontier) == beam:
+                    break
+            frontier = next_frontier
+            if frontier:
+                best = frontier[0]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    elapsed = time.perf_counter() - start
+
+    final = DrMario()
+    final.restore(best[1])
+    return {
+        'rows': rows,
+        'cols': cols,
+        'beam': beam,
+        'workers': workers,
+        'grounded': grounded,
+        'cleared': cleared,
+        'pills_used': sum(1 for command in best[2] if command.startswith('F ')),
+        'pills_searched': pills_used,
+        'viruses_left': sum(final.virus_counts().values()),
+        'commands': best[2],
+        'final_field': final.field_lines(),
+        'nodes': nodes,
+        'seconds': elapsed,
+        'nodes_per_second': nodes / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def replay(lines: List[str], commands: List[str]) -> DrMario:
+    # Runs a solution through step() from the starting layout
+    game = DrMario()
+    game.initialize(len(lines), len(lines[0]) if lines else 0)
+    game.set_field_contents(lines)
+    for command in commands:
+        game.step(command)
+    return game
+
+
+def parse_queue(text: str) -> List[Tuple[str, str]]:
+    pills = []
+    for pair in text.split():
+        if len(pair) != 2 or any(color not in 'RYB' for color in pair):
+            raise ValueError(f"Bad pill {pair!r}: expected two of R, Y, B such as 'RY'")
+        pills.append((pair[0], pair[1]))
+    return pills
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Beam-search a pill sequence that clears a level.')
+    parser.add_argument('level', help='file with one line per board row')
+    parser.add_argument('--beam', type=int, default=64, help='boards kept after each pill')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--grounded', action='store_true', help='skip placements that freeze in mid-air')
+    parser.add_argument('--queue', help="pill order, e.g. 'RY BB YR'")
+    parser.add_argument('--pills', type=int, default=40, help='random pills to draw without --queue')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    with open(args.level) as f:
+        lines = [line.rstrip('\n') for line in f if line.strip('\n')]
+    cols = max(len(line) for line in lines)
+    lines = [line.ljust(cols) for line in lines]
+
+    if args.queue:
+        pills = parse_queue(args.queue)
+    else:
+        rnd = random.Random(args.seed)
+        pills = [(rnd.choice('RYB'), rnd.choice('RYB')) for _ in range(args.pills)]
+
+    report = solve(lines, pills, args.beam, args.workers, args.grounded)
+    final = replay(lines, report['commands'])
+    report['replay_matches'] = final.field_lines() == report['final_field']
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    print(f"{'cleared' if report['cleared'] else 'not cleared'} with {report['pills_used']} pills, "
+          f"{report['viruses_left']} viruses left; {report['nodes']} nodes in {report['seconds']:.2f}s "
+          f"({report['nodes_per_second']:.0f} nodes/s, {args.workers} workers)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
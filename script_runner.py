@@ -0,0 +1,138 @@
+# script_runner.py
+#
+# Replays many a2.py command scripts through the engine in parallel and
+# writes one JSON report with each script's output hash, final state and
+# timing.  Scripts are split into shards that worker processes run
+# in-process with a2.run_batch, so no interpreter is started per script.
+#
+#   python script_runner.py [--workers N] [--report FILE] [--engine NAME] PATH...
+#
+# Each PATH is a script file or a directory whose *.txt files are scripts.
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import a2
+from dr_mario_backends import DEFAULT_BACKEND, ENV_VAR, backend_names, load_backend, selected_backend
+from dr_mario_logic import DrMario
+
+
+def run_script_file(path: str, engine=DrMario) -> dict:
+    start = time.perf_counter()
+    with open(path) as f:
+        text = f.read()
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        game = a2.run_batch(a2.split_script(text), engine)
+    output = out.getvalue()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'script': path,
+        'output_sha256': hashlib.sha256(output.encode()).hexdigest(),
+        'output_lines': output.count('\n'),
+        'seconds': elapsed
+    }
+    if game is not None:
+        result['final_field'] = game.field_lines()
+        faller = game.faller
+        if faller is not None and not isinstance(faller, dict):
+            # Engines with their own faller type report it as DrMario does
+            faller = faller.as_dict()
+        result['faller'] = faller
+        result['game_over'] = game.is_game_over
+        result['virus_counts'] = game.virus_counts()
+    return result
+
+
+def run_shard(paths: List[str], engine_name: str = DEFAULT_BACKEND) -> List[dict]:
+    engine = load_backend(engine_name)
+    return [run_script_file(path, engine) for path in paths]
+
+
+def find_scripts(paths: List[str]) -> List[str]:
+    scripts = []
+    for path in paths:
+        p = pathlib.Path(path)
+        if p.is_dir():
+            scripts.extend(str(s) for s in sorted(p.glob('*.txt')))
+        else:
+            scripts.append(str(p))
+    return scripts
+
+
+def shard(scripts: List[str], workers: int) -> List[List[str]]:
+    # A few shards per worker keeps workers busy when script sizes vary,
+    # without paying task overhead per script.
+    count = max(1, min(len(scripts), workers * 4))
+    return [scripts[i::count] for i in range(count)]
+
+
+def run_all(scripts: List[str], workers: int, engine_name: str = DEFAULT_BACKEND) -> dict:
+    start = time.perf_counter()
+    results = []
+    if workers <= 1:
+        results = run_shard(scripts, engine_name)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            shards = shard(scripts, workers)
+            for shard_results in pool.map(run_shard, shards, [engine_name] * len(shards)):
+                results.extend(shard_results)
+    results.sort(key=lambda result: result['script'])
+    elapsed = time.perf_counter() - start
+
+    return {
+        'engine': engine_name,
+        'workers': workers,
+        'scripts': len(results),
+        'wall_seconds': elapsed,
+        'script_seconds': sum(result['seconds'] for result in results),
+        'results': results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a2.py scripts in parallel.')
+    parser.add_argument('paths', nargs='+', help='script files or directories of *.txt scripts')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--report', help='write the JSON report here instead of stdout')
+    parser.add_argument('--engine', choices=backend_names('game'),
+                        help=f'engine to run the scripts on (default ${ENV_VAR} or {DEFAULT_BACKEND})')
+    parser.add_argument('--bitboard', action='store_true', help='same as --engine bitboard')
+    args = parser.parse_args()
+    if args.bitboard:
+        args.engine = 'bitboard'
+    if args.engine is None:
+        try:
+            args.engine = selected_backend([])
+        except ValueError as e:
+            parser.error(str(e))
+    if args.engine not in backend_names('game'):
+        parser.error(f"unknown engine {args.engine!r} in ${ENV_VAR}")
+
+    report = run_all(find_scripts(args.paths), args.workers, args.engine)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    print(f"{report['scripts']} scripts in {report['wall_seconds']:.2f}s "
+          f"({report['script_seconds']:.2f}s of engine time, {args.workers} workers)",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()